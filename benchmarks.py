@@ -0,0 +1,1480 @@
+# This program benchmarks the toolbox modules on synthetic data
+# Example: > python benchmarks.py which=header_dispatch n_docs=200 n_paras=2000
+# Time all public functions across input sizes, saving a baseline: which=suite save=baseline.json
+# ... and later compare against it, exiting with status 1 on regressions: which=suite baseline=baseline.json
+# (any benchmark exits with status 1 if its results are not identical to the original's, too)
+
+import collections
+import cStringIO
+import csv
+import hashlib
+import inspect
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import bjd_nlp
+import instrumentation
+import my_new_module
+
+
+################################################################################
+def make_lexis_nexis_export(n_docs=1000, n_paras=20, seed=0, header_rate=0.5) :
+    """Generates a synthetic LexisNexis export with a cover page and n_docs
+    documents, each with a random mix of header fields.
+    @param n_paras: Maximum number of article paragraphs per document
+    @type n_paras: int
+    @param header_rate: Probability of each optional header field being present
+    @type header_rate: float
+    @param seed: Seed for random number generator, for reproducibility
+    @type seed: int
+    """
+    rand = random.Random(seed)
+    words = ['the', 'of', 'market', 'said', 'president', 'vote', 'city',
+        'health', 'school', 'budget', 'court', 'police', 'news', 'reform']
+    months = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+        'August', 'September', 'October', 'November', 'December']
+    headers = ['SHOW: Evening News', 'ANCHORS: Jane Doe', 'GUESTS: John Doe',
+        'BYLINE: By JOHN DOE', 'SECTION: Section A; Column 0; Pg. 1',
+        'LENGTH: 812 words', 'JOURNAL-CODE: NYT']
+    out = ['Download Request: Select All Documents\r\n',
+        'Terms: health care\r\nand reform\r\n\r\n',
+        'Source: Major US Newspapers\r\n']
+    for i in xrange(n_docs) :
+        out.append('\r\n%30d of %d DOCUMENTS\r\n\r\n' % (i + 1, n_docs))
+        out.append('%40s\r\n\r\n' % 'The New York Times')
+        if rand.random() < 0.2 : out.append('%40s\r\n\r\n' % 'Late Edition - Final')
+        out.append('%30s %d, 2012 Monday\r\n\r\n' % (rand.choice(months), rand.randint(1, 28)))
+        for header in headers :
+            if rand.random() < header_rate : out.append(header + '\r\n\r\n')
+        for j in xrange(rand.randint(1, n_paras)) :
+            para = ' '.join(rand.choice(words) for k in xrange(rand.randint(5, 60)))
+            out.append(para + '\r\n\r\n')
+        out.append('LOAD-DATE: March 4, 2012\r\n\r\nLANGUAGE: ENGLISH\r\n\r\n')
+        out.append('PUBLICATION-TYPE: Newspaper\r\n\r\n')
+        out.append('Copyright 2012 The New York Times Company\r\n')
+        out.append('%40s\r\n' % 'All Rights Reserved')
+    return ''.join(out)
+
+
+################################################################################
+def make_news_texts(n_texts=10000, n_words=300, seed=0) :
+    """Generates synthetic raw news texts mixing words, digits, URLs, odd white
+    space and non-ascii characters (half as byte strings, half as unicode).
+    """
+    rand = random.Random(seed)
+    tokens = ['The', 'market', 'said', 'President', 'vote', 'City', 'health',
+        'school', '2012', '$1,200', '45%', 'http://www.example.com/a?b=1',
+        'nytimes.com', 'e.g.', 'caf\xc3\xa9', 'na\xc3\xafve', '\xe2\x80\x94',
+        '\t', '\r\n', '  ']
+    texts = []
+    for i in xrange(n_texts) :
+        text = ' '.join(rand.choice(tokens) for j in xrange(n_words))
+        if i % 2 == 1 : text = text.decode('utf-8')
+        texts.append(text)
+    return texts
+
+
+################################################################################
+def make_zipf_tokens(n_tokens=1000000, vocab_size=50000, exponent=1.1, seed=0) :
+    """Generates a Zipf-distributed stream of word tokens, like real text: the
+    most frequent words are common English stopwords, the rest synthetic words.
+    """
+    import numpy as np
+    common = ['the', 'of', 'and', 'to', 'a', 'in', 'that', 'is', 'was', 'he',
+        'for', 'it', 'with', 'as', 'his', 'on', 'be', 'at', 'by', 'i', 'said',
+        'new', 'york', 'president', 'market', 'health', 'care', 'court', 'city']
+    syllables = ['ka', 'ri', 'to', 'men', 'sul', 'va', 'dor', 'pe', 'lin', 'gra']
+    vocab = list(common)
+    i = 0
+    while len(vocab) < vocab_size :
+        word, j = '', i
+        while True :
+            word += syllables[j % len(syllables)]
+            j //= len(syllables)
+            if j == 0 : break
+        vocab.append(word + 'n')
+        i += 1
+    probs = 1.0 / np.arange(1, vocab_size + 1) ** exponent
+    ranks = np.random.RandomState(seed).choice(vocab_size, size=n_tokens, p=probs / probs.sum())
+    return [vocab[rank] for rank in ranks]
+
+
+################################################################################
+def make_box_office_html(n_weeks=52, seed=0, n_links=300) :
+    """Generates a synthetic Box Office Mojo weekly chart page for a film, with
+    the quirks the scraper cleans up: dollar signs, commas, percentages, rank
+    pairs split by ' / ', chart links, and cp1252 dashes. Like the real pages,
+    the chart comes after navigation tables with n_links links; some charts
+    have more than one class.
+    """
+    rand = random.Random(seed)
+    out = ['<html><head><title>Weekly Box Office</title>',
+        '<script type="text/javascript">var page = "weekly";</script></head><body>',
+        '<table class="navbar" width="100%"><tr>']
+    for i in xrange(n_links) :
+        out.append('<td class="nav"><a href="/movies/?id=film%d.htm"><font size="1">Film %d</font></a></td>' % (i, i))
+        if i % 10 == 9 : out.append('</tr><tr>')
+    out += ['</tr></table>',
+        '<table class="%s"><tr><td><font size="2">Date <br>(click to view chart)</font></td>'
+            % ('chart-wide sortable' if seed % 3 == 2 else 'chart-wide'),
+        '<td>Rank</td><td>Weekly Gross</td><td>% Change</td><td>Theaters / Change</td>',
+        '<td>Avg.</td><td>Gross-to-Date</td><td>Week #</td></tr>']
+    total = 0
+    for week in xrange(1, n_weeks + 1) :
+        gross = rand.randint(1000, 5000000)
+        total += gross
+        out.append('<tr><td><a href="/weekly/chart/?yr=2012&wk=%d"><b>Mar %d\x96%d</b></a></td>'
+            % (week, week % 28 + 1, week % 28 + 7))
+        out.append('<td>%d</td><td>$%s</td><td><font color="#ff0000">%+.1f%%</font></td>'
+            % (rand.randint(1, 100), format(gross, ',d'), rand.uniform(-90, 90)))
+        out.append('<td>%d / %+d</td><td>$%s</td><td>$%s</td><td>%d</td></tr>'
+            % (rand.randint(1, 3000), rand.randint(-500, 500),
+               format(gross // 10, ',d'), format(total, ',d'), week))
+    out.append('</table></body></html>')
+    return ''.join(out)
+
+
+################################################################################
+def serve_stub_pages(pages, delay=0.0, fail_every=0) :
+    """Serves pages {path: html} from a local threaded HTTP server, in a daemon
+    thread, responding after delay seconds, and with a 503 to every fail_every-th
+    request if fail_every. Pages have an ETag, and a 304 is sent instead of a
+    page if its ETag is given in If-None-Match. Returns server, whose base URL is
+    'http://127.0.0.1:%d' % server.server_port; call server.shutdown() when done.
+    """
+    import BaseHTTPServer
+    import SocketServer
+    import threading
+    counter = itertools.count(1)
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler) :
+        protocol_version = 'HTTP/1.1'
+        def do_GET(self) :
+            time.sleep(delay)
+            page = pages.get(self.path)
+            etag = '"%s"' % hashlib.sha1(page).hexdigest() if page is not None else None
+            if fail_every and next(counter) % fail_every == 0 : status = 503
+            elif page is None : status = 404
+            elif etag == self.headers.get('If-None-Match') : status = 304
+            else : status = 200
+            body = page if status == 200 else ''
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html')
+            if etag is not None : self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args) :
+            pass
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer) :
+        daemon_threads = True
+        request_queue_size = 128
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+################################################################################
+def make_syndicated_texts(n_stories=1000, n_words=300, max_copies=3, seed=0) :
+    """Generates news texts in which some stories are syndicated: copied, with
+    a wire credit, a few edited words and a truncated end, and shuffled.
+    return: (texts, number of the story each text is a copy of)
+    """
+    rand = random.Random(seed)
+    tokens = make_zipf_tokens(n_stories * n_words, seed=seed)
+    texts = []
+    for i in xrange(n_stories) :
+        words = tokens[i * n_words:(i + 1) * n_words]
+        texts.append((' '.join(words), i))
+        for j in xrange(rand.choice([0, 0, 1, max_copies])) :
+            copy = list(words)
+            for k in xrange(rand.randint(0, 5)) :
+                copy[rand.randrange(n_words)] = 'edit%d' % rand.randint(0, 99)
+            copy = ['(AP)'] + copy[:rand.randint(n_words * 9 // 10, n_words)]
+            texts.append((' '.join(copy), i))
+    rand.shuffle(texts)
+    return [text for text, story in texts], [story for text, story in texts]
+
+
+################################################################################
+def best_time(func, args=(), repeat=3) :
+    """Returns the best wall-clock time in seconds of repeat calls to func(*args).
+    """
+    times = []
+    for i in xrange(repeat) :
+        start = time.time()
+        func(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+
+# names of benchmarks whose optimized results did not match the originals'
+mismatches = []
+
+
+################################################################################
+def check_identical(name, identical) :
+    """Records a benchmark whose results are not identical to the reference
+    results, so the run exits with a non-zero status. Returns identical.
+    """
+    if not identical : mismatches.append(name)
+    return identical
+
+
+################################################################################
+def _parse_header_lines_chained(lines) :
+    """Original header extraction: a chain of startswith checks plus a list
+    deletion per match. Kept only as a baseline for benchmark_header_dispatch.
+    """
+    row = dict((key, 'NA') for key in my_new_module.KEYS)
+    for line in lines[:] :
+        if line.startswith('SHOW: ') :
+            row['show'] = line[len('SHOW: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('ANCHORS: ') :
+            row['anchors'] = line[len('ANCHORS: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('GUESTS: ') :
+            row['guests'] = line[len('GUESTS: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('BLOG: ') :
+            row['blog'] = line[len('BLOG: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('BYLINE: ') :
+            row['byline'] = line[len('BYLINE: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('SECTION: ') :
+            row['section'] = line[len('SECTION: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('LENGTH: ') :
+            row['length'] = line[len('LENGTH: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('LANGUAGE:') :
+            row['language'] = line[len('LANGUAGE:'):].lower()
+            del lines[lines.index(line)]
+        elif line.startswith('LOAD-DATE: ') :
+            row['load_date'] = line[len('LOAD-DATE: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('PUBLICATION-TYPE: ') :
+            row['pub_type'] = line[len('PUBLICATION-TYPE: '):].lower()
+            del lines[lines.index(line)]
+        elif line.startswith('JOURNAL-CODE: ') :
+            row['journal_code'] = line[len('JOURNAL-CODE: '):]
+            del lines[lines.index(line)]
+        elif line.startswith('Copyright ') :
+            row['copyright'] = line[len('Copyright '):]
+            del lines[-3:]
+    return row
+
+
+################################################################################
+def benchmark_header_dispatch(n_docs=200, n_paras=2000) :
+    """Compares the original startswith chain against the single-pass prefix
+    dispatch of sort_header_lines on long synthetic documents.
+    """
+    export = make_lexis_nexis_export(n_docs, n_paras)
+    docs = list(my_new_module.iter_lexis_nexis_chunks(export.splitlines(True)))[1:]
+    doc_lines = []
+    for doc in docs :
+        lines = re.split('\r\n|\n\n', doc)
+        doc_lines.append([line.strip() for line in lines if line != ''])
+
+    def chained() :
+        for lines in doc_lines : _parse_header_lines_chained(list(lines))
+    def dispatch() :
+        for lines in doc_lines : my_new_module.sort_header_lines(lines, {})
+
+    n_lines = sum(len(lines) for lines in doc_lines)
+    print "\nINFO: HEADER DISPATCH,", n_docs, "docs,", n_lines, "lines"
+    t_chained = best_time(chained)
+    t_dispatch = best_time(dispatch)
+    print "... startswith chain = %.3f s" % t_chained
+    print "... prefix dispatch = %.3f s" % t_dispatch
+    print "... speedup = %.1fx" % (t_chained / t_dispatch)
+
+
+################################################################################
+def benchmark_parse_workers(n_docs=20000, n_paras=20) :
+    """Times iter_lexis_nexis_docs with 1, 2, 4 and 8 worker processes, checking
+    that parallel output is byte-identical to the serial output.
+    """
+    export = make_lexis_nexis_export(n_docs, n_paras).splitlines(True)
+
+    def parse(workers) :
+        outFile = cStringIO.StringIO()
+        csv_writer = csv.DictWriter(outFile, my_new_module.KEYS, delimiter="\t")
+        for row in my_new_module.iter_lexis_nexis_docs(export, workers=workers) :
+            csv_writer.writerow(row)
+        return outFile.getvalue()
+
+    print "\nINFO: PARSE WORKERS,", n_docs, "docs,", sum(len(line) for line in export), "bytes"
+    serial = parse(1)
+    t_serial = best_time(parse, (1,))
+    for workers in [1, 2, 4, 8] :
+        t = t_serial if workers == 1 else best_time(parse, (workers,))
+        identical = check_identical('parse_workers', workers == 1 or parse(workers) == serial)
+        print "... workers = %d: %.3f s, %.0f docs/s, speedup = %.1fx, identical = %s" % (
+            workers, t, n_docs / t, t_serial / t, identical)
+
+
+################################################################################
+def benchmark_columnar(n_docs=20000, n_paras=20) :
+    """Compares file size and read speed of TSV and Parquet output, reading
+    either everything or only metadata columns.
+    """
+    export = make_lexis_nexis_export(n_docs, n_paras).splitlines(True)
+    rows = list(my_new_module.iter_lexis_nexis_docs(export))
+    meta_keys = ['pub', 'pub_date', 'section', 'language', 'pub_type']
+    tmpdir = tempfile.mkdtemp()
+    try :
+        print "\nINFO: COLUMNAR OUTPUT,", n_docs, "docs"
+        for name in ['tsv', 'parquet'] :
+            outFileName = os.path.join(tmpdir, 'out.' + name)
+            start = time.time()
+            out = my_new_module.WRITERS[name](outFileName)
+            for row in rows : out.writerow(row)
+            out.close()
+            print "... %s: write = %.3f s, size = %.1f MB" % (
+                name, time.time() - start, os.path.getsize(outFileName) / 1e6)
+
+        def read_tsv(keys) :
+            with open(os.path.join(tmpdir, 'out.tsv'), 'r') as f :
+                return [[row[key] for key in keys] for row in csv.DictReader(f, delimiter="\t")]
+        def read_parquet(keys) :
+            return my_new_module.read_lexis_nexis_parquet(os.path.join(tmpdir, 'out.parquet'), keys)
+
+        for label, keys in [('all columns', my_new_module.KEYS), ('metadata only', meta_keys)] :
+            print "... read %s: tsv = %.3f s, parquet = %.3f s" % (
+                label, best_time(read_tsv, (keys,)), best_time(read_parquet, (keys,)))
+    finally :
+        shutil.rmtree(tmpdir)
+
+
+################################################################################
+def _clean_text_reference(text) :
+    """Original clean_text, kept only as a baseline for benchmark_clean_text.
+    """
+    pattern = r'((http|ftp|https):\/\/)?[\w\-_]+(\.[\w\-_]+)+([\w\-\.,@?^=%&amp;:/~\+#]*[\w\-\@?^=%&amp;/~\+#])?'
+    text = text.lower()
+    text = re.sub('\d', ' ', text)
+    text = re.sub('\s+', ' ', text)
+    text = re.sub(pattern, ' ', text)
+    return "".join(c for c in text if ord(c)<128)
+
+
+################################################################################
+def benchmark_clean_text(n_texts=10000) :
+    """Compares the original clean_text against TextCleaner, checking that they
+    give identical results.
+    """
+    texts = make_news_texts(n_texts)
+    cleaner = bjd_nlp.TextCleaner()
+    expected = [_clean_text_reference(text) for text in texts]
+    identical = check_identical('clean_text', list(cleaner.clean_many(texts)) == expected)
+    print "\nINFO: CLEAN TEXT,", n_texts, "texts"
+    t_old = best_time(lambda: [_clean_text_reference(text) for text in texts])
+    t_new = best_time(lambda: list(cleaner.clean_many(texts)))
+    print "... original = %.3f s, TextCleaner = %.3f s, speedup = %.1fx, identical = %s" % (
+        t_old, t_new, t_old / t_new, identical)
+
+
+################################################################################
+def benchmark_stopwords(n_tokens=10000000) :
+    """Compares the original collocation filters, which rebuilt the stopword set
+    for every word tested, against the cached stopword and stop-ngram sets, on
+    all distinct bigrams of a Zipfian token stream.
+    """
+    import nltk
+    tokens = make_zipf_tokens(n_tokens)
+    bigrams = list(set(zip(tokens, tokens[1:])))
+    stop_ngs = ['new york', 'health care', 'supreme court']
+
+    def original() :
+        word_filter = lambda w: len(w) < 3 or w in set(nltk.corpus.stopwords.words('english'))
+        ngram_filter = lambda w1, w2: ' '.join([w1,w2]) in stop_ngs
+        return [ng for ng in bigrams
+                if not any(word_filter(w) for w in ng) and not ngram_filter(*ng)]
+    def cached() :
+        stopwords = bjd_nlp.get_stopwords('english')
+        stop_ngrams = bjd_nlp.get_stop_ngrams(stop_ngs)
+        word_filter = lambda w: len(w) < 3 or w in stopwords
+        ngram_filter = lambda *ngram: ngram in stop_ngrams
+        return [ng for ng in bigrams
+                if not any(word_filter(w) for w in ng) and not ngram_filter(*ng)]
+
+    print "\nINFO: STOPWORD FILTERS,", n_tokens, "tokens,", len(bigrams), "distinct bigrams"
+    # the original is slow enough to only run once
+    start = time.time()
+    expected = original()
+    t_old = time.time() - start
+    t_new = best_time(cached)
+    print "... original = %.3f s, cached = %.3f s, speedup = %.1fx, identical = %s" % (
+        t_old, t_new, t_old / t_new, check_identical('stopwords', cached() == expected))
+
+
+################################################################################
+def benchmark_ngrams(n_tokens=1000000) :
+    """Compares NLTK-based get_nbest_bigrams/trigrams against the numpy-based
+    get_nbest_ngrams, checking that they pick the same n best ngrams.
+    """
+    tokens = make_zipf_tokens(n_tokens)
+    print "\nINFO: NGRAM COLLOCATIONS,", n_tokens, "tokens"
+    for n, nltk_func in [(2, bjd_nlp.get_nbest_bigrams), (3, bjd_nlp.get_nbest_trigrams)] :
+        for measure in ['pmi', 'likelihood_ratio'] :
+            start = time.time()
+            expected = nltk_func(tokens, measure=measure, min_freq=3, n_best=100)
+            t_old = time.time() - start
+            start = time.time()
+            result = bjd_nlp.get_nbest_ngrams(tokens, n=n, measure=measure, min_freq=3, n_best=100)
+            t_new = time.time() - start
+            print "... n = %d, %s: nltk = %.3f s, numpy = %.3f s, speedup = %.1fx, identical = %s" % (
+                n, measure, t_old, t_new, t_old / t_new, check_identical('ngrams', result == expected))
+
+
+################################################################################
+def benchmark_tagging(n_texts=2000) :
+    """Measures tokenize_and_tag_many throughput in documents per second with
+    1, 2, 4 and 8 workers, against tokenize_and_tag one text at a time.
+    Requires NLTK's punkt and averaged_perceptron_tagger models.
+    """
+    texts = [bjd_nlp.clean_text(text) for text in make_news_texts(n_texts, n_words=50)]
+    print "\nINFO: TOKENIZE AND TAG,", n_texts, "texts"
+    start = time.time()
+    expected = [bjd_nlp.tokenize_and_tag(text) for text in texts]
+    t_serial = time.time() - start
+    print "... tokenize_and_tag: %.3f s, %.0f docs/s" % (t_serial, n_texts / t_serial)
+    for workers in [1, 2, 4, 8] :
+        start = time.time()
+        result = list(bjd_nlp.tokenize_and_tag_many(texts, workers=workers))
+        t = time.time() - start
+        print "... workers = %d: %.3f s, %.0f docs/s, speedup = %.1fx, identical = %s" % (
+            workers, t, n_texts / t, t_serial / t, check_identical('tagging', result == expected))
+
+
+################################################################################
+def _tag_with_broken_tagger(conn) :
+    """Runs tokenize_and_tag_many with 2 workers and a tagger that fails to load,
+    sending whether it raised LookupError.
+    """
+    def get_tagger() :
+        raise LookupError('tagger model not found')
+    bjd_nlp.get_tagger = get_tagger
+    try :
+        list(bjd_nlp.tokenize_and_tag_many(make_news_texts(20, n_words=50), workers=2, chunksize=5))
+        conn.send(False)
+    except LookupError :
+        conn.send(True)
+    conn.close()
+
+
+################################################################################
+def benchmark_pool_errors(timeout=60) :
+    """Checks that tokenize_and_tag_many with workers > 1 raises when the tagger
+    fails to load, e.g. without NLTK's data, instead of hanging its pool.
+    """
+    print "\nINFO: POOL ERRORS"
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=_tag_with_broken_tagger, args=(sender,))
+    start = time.time()
+    process.start()
+    sender.close()
+    raised = receiver.poll(timeout) and receiver.recv()
+    hung = process.is_alive() and not raised
+    if process.is_alive() : process.terminate()
+    process.join()
+    print "... workers = 2, tagger fails to load: %s after %.1f s, identical = %s" % (
+        'hung' if hung else 'raised' if raised else 'no error', time.time() - start,
+        check_identical('pool errors', raised is True))
+
+
+################################################################################
+def benchmark_stemming(n_tokens=1000000, doc_length=500) :
+    """Compares stemming documents with a new stemmer per call and every token
+    stemmed, as stem_words used to, against the cached stem_words, and reports
+    the stem cache's statistics and approximate memory use.
+    """
+    import nltk
+    tokens = make_zipf_tokens(n_tokens)
+    docs = [tokens[i:i + doc_length] for i in xrange(0, n_tokens, doc_length)]
+
+    def original() :
+        return [[nltk.PorterStemmer().stem(word) for word in doc] for doc in docs]
+    def cached() :
+        return [bjd_nlp.stem_words(doc) for doc in docs]
+
+    print "\nINFO: STEMMING,", len(docs), "docs,", n_tokens, "tokens"
+    start = time.time()
+    expected = original()
+    t_old = time.time() - start
+    bjd_nlp.get_stemmer('porter').clear()
+    start = time.time()
+    result = cached()
+    t_cold = time.time() - start
+    info = bjd_nlp.get_stemmer('porter').info()
+    t_warm = best_time(cached)
+    print "... original = %.3f s, cached (cold) = %.3f s, cached (warm) = %.3f s" % (t_old, t_cold, t_warm)
+    print "... speedup = %.1fx cold, %.1fx warm, identical = %s" % (
+        t_old / t_cold, t_old / t_warm, check_identical('stemming', result == expected))
+    cache = bjd_nlp.get_stemmer('porter').cache
+    n_bytes = sys.getsizeof(cache) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in cache.iteritems())
+    print "... cache after one pass: %(hits)d hits, %(misses)d misses, %(size)d entries" % info,
+    print "(~%.1f MB)" % (n_bytes / 1e6)
+
+
+################################################################################
+def benchmark_features(n_docs=20000, doc_length=500) :
+    """Compares build time and memory of bag_of_words dicts against the sparse
+    bag_of_words_matrix for a corpus of Zipfian documents.
+    """
+    tokens = make_zipf_tokens(n_docs * doc_length)
+    docs = [tokens[i:i + doc_length] for i in xrange(0, len(tokens), doc_length)]
+    bad_words = ['the', 'of', 'and']
+    print "\nINFO: FEATURES,", n_docs, "docs,", len(tokens), "tokens"
+
+    start = time.time()
+    featuresets = [bjd_nlp.bag_of_words(doc, bad_words) for doc in docs]
+    t_dicts = time.time() - start
+    n_dicts = sum(sys.getsizeof(features) for features in featuresets)
+
+    start = time.time()
+    matrix, vocabulary = bjd_nlp.bag_of_words_matrix(docs, bad_words=bad_words)
+    t_matrix = time.time() - start
+    n_matrix = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    identical = check_identical('features',
+        list(bjd_nlp.matrix_to_featuresets(matrix, vocabulary)) == featuresets)
+
+    print "... dicts: build = %.3f s, memory = %.1f MB" % (t_dicts, n_dicts / 1e6)
+    print "... sparse matrix: build = %.3f s, memory = %.1f MB, identical = %s" % (
+        t_matrix, n_matrix / 1e6, identical)
+
+
+################################################################################
+def benchmark_label_features(n_files=200, doc_length=500, workers=2) :
+    """Compares the old get_label_features_from_corpus, which featurized the
+    whole corpus for every file, against per-file featurizing, serial and in a
+    pool of workers, and against reloading featuresets from the on-disk cache.
+    """
+    from nltk.corpus.reader import CategorizedPlaintextCorpusReader
+    tokens = make_zipf_tokens(n_files * doc_length)
+    tmpDir = tempfile.mkdtemp()
+    try :
+        for i in xrange(n_files) :
+            with open(os.path.join(tmpDir, 'cat%d_%05d.txt' % (i % 2, i)), 'w') as f :
+                f.write(' '.join(tokens[i * doc_length:(i + 1) * doc_length]))
+        corpus = CategorizedPlaintextCorpusReader(tmpDir, r'cat.*\.txt',
+                                                  cat_pattern=r'(cat\d)_.*')
+        print "\nINFO: LABEL FEATURES,", n_files, "files,", len(tokens), "tokens"
+
+        # old version, on a tenth of the files: every file got the whole corpus' words
+        fileids = corpus.fileids()[:max(n_files // 10, 1)]
+        start = time.time()
+        for fileid in fileids : bjd_nlp.bag_of_words(corpus.words())
+        t_old = (time.time() - start) * n_files / len(fileids)
+        print "... whole corpus per file (extrapolated) = %.3f s" % t_old
+
+        cacheDir = os.path.join(tmpDir, 'cache')
+        for label, kwargs in [('per file', {}), ('per file, %d workers' % workers,
+                {'workers': workers}), ('writing cache', {'cache_dir': cacheDir}),
+                ('reading cache', {'cache_dir': cacheDir})] :
+            start = time.time()
+            label_features = bjd_nlp.get_label_features_from_corpus(corpus, **kwargs)
+            print "... %s = %.3f s" % (label, time.time() - start)
+        print "... featuresets =", sum(len(f) for f in label_features.values())
+    finally :
+        shutil.rmtree(tmpDir)
+
+
+################################################################################
+def benchmark_split(n_docs=100000, k=5) :
+    """Times split_label_features, the shuffled streaming split, and a full
+    k-fold pass over a labeled dict of small featuresets.
+    """
+    label_features = {'pos': [{'w%d' % i: True} for i in xrange(0, n_docs, 2)],
+                      'neg': [{'w%d' % i: True} for i in xrange(1, n_docs, 2)]}
+    print "\nINFO: SPLIT,", n_docs, "featuresets,", k, "folds"
+    t_prefix = best_time(bjd_nlp.split_label_features, (label_features,))
+    stream = lambda: sum(1 for is_train, instance
+                         in bjd_nlp.iter_split_label_features(label_features) if is_train)
+    t_stream = best_time(stream)
+    def kfold() :
+        for train, test in bjd_nlp.kfold_label_features(label_features, k) :
+            for instance in train : pass
+    t_kfold = best_time(kfold, repeat=1)
+    print "... prefix split (lists) = %.3f s" % t_prefix
+    print "... stratified shuffled split (stream) = %.3f s" % t_stream
+    print "... %d-fold, streaming every train set = %.3f s" % (k, t_kfold)
+
+
+################################################################################
+def benchmark_scraper(n_films=200, delay_ms=50, workers=16) :
+    """Compares the old scraper's sequential requests.get calls against
+    scrape_films' pooled session and thread pool, on a local stub server with
+    delay_ms of latency per request that fails every 20th request once.
+    """
+    import requests
+    import box_office_mojo_scraper as bom
+    film_ids = ['film%04d' % i for i in xrange(n_films)]
+    pages = dict(('/movies/?page=weekly&id=%s.htm' % film_id, make_box_office_html(52, i))
+                 for i, film_id in enumerate(film_ids))
+    server = serve_stub_pages(pages, delay_ms / 1000.0, fail_every=20)
+    base_url = 'http://127.0.0.1:%d/movies' % server.server_port
+    tmpDir = tempfile.mkdtemp()
+    try :
+        print "\nINFO: SCRAPER,", n_films, "films,", delay_ms, "ms latency"
+        start = time.time()
+        n_failed = 0
+        for film_id in film_ids :
+            response = requests.get(bom.get_film_url(film_id, base_url),
+                                    headers={'User-agent': bom.USER_AGENT})
+            if response.status_code != 200 : n_failed += 1
+        t_old = time.time() - start
+        print "... sequential requests.get = %.3f s, %d failed" % (t_old, n_failed)
+
+        start = time.time()
+        fetcher = bom.Fetcher(workers, retries=3, timeout=5)
+        urls = [bom.get_film_url(film_id, base_url) for film_id in film_ids]
+        n_failed = sum(1 for url, response, error in fetcher.fetch_many(urls) if error)
+        fetcher.close()
+        print "... Fetcher.fetch_many, %d workers = %.3f s, %d failed" % (
+            workers, time.time() - start, n_failed)
+
+        outFilePattern = os.path.join(tmpDir, '%s.txt')
+        stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+        try :
+            start = time.time()
+            fetcher = bom.scrape_films(film_ids, outFilePattern, base_url, workers,
+                                       retries=3, timeout=5)
+            t_new = time.time() - start
+        finally :
+            sys.stdout = stdout
+        summary = fetcher.summary()
+        print "... scrape_films, %d workers (fetch + parse + write) = %.3f s" % (workers, t_new)
+        print "... %d requests, %d errors, %d retries, median = %.3f s, p95 = %.3f s" % (
+            summary['requests'], summary['errors'], summary['retries'],
+            summary['median'], summary['p95'])
+        print "... files written =", len(os.listdir(tmpDir))
+
+        # re-scrapes through the response cache: downloading everything the first
+        # time, then revalidating unchanged pages, serving them fresh, and offline
+        cacheDir = os.path.join(tmpDir, 'cache')
+        for label, kwargs in [('cold cache', {}), ('revalidating', {'ttl': 0}),
+                ('fresh cache', {}), ('offline', {'offline': True})] :
+            stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+            try :
+                start = time.time()
+                fetcher = bom.scrape_films(film_ids, outFilePattern, base_url, workers,
+                                           retries=3, timeout=5, cache_dir=cacheDir, **kwargs)
+                t_cache = time.time() - start
+            finally :
+                sys.stdout = stdout
+            print "... scrape_films, %s = %.3f s, %s" % (label, t_cache, fetcher.summary()['cache'])
+    finally :
+        server.shutdown()
+        shutil.rmtree(tmpDir)
+
+
+################################################################################
+def _parse_film_weekly_reference(html) :
+    """Reference copy of the old parse_film_weekly_box_office: whole page parsed
+    with BeautifulSoup's default parser, and four uncompiled re.sub calls per cell.
+    """
+    import bs4
+    soup = bs4.BeautifulSoup(html)
+    body = soup.find('body')
+    rows = []
+    for table in body.find_all('table', class_='chart-wide') :
+        for tr in table.find_all('tr') :
+            row = []
+            for td in tr.find_all('td') :
+                text = ' '.join(td.find_all(text=True))
+                text = re.sub(' \(click to view chart\)', '', text)
+                text = re.sub('\x96', '_', text)
+                text = re.sub('\$|%|,', '', text)
+                if re.search(' / ', text) is not None :
+                    row.extend(re.split(' / ', text))
+                    continue
+                row.append(text)
+            rows.append(row)
+    return rows
+
+
+################################################################################
+def benchmark_chart_parsing(n_pages=100, n_weeks=52) :
+    """Compares parse times of the old chart parser and parse_film_weekly_box_office,
+    with lxml and with its BeautifulSoup fallback, over a set of saved pages.
+    """
+    import warnings
+    import box_office_mojo_scraper as bom
+    tmpDir = tempfile.mkdtemp()
+    try :
+        for i in xrange(n_pages) :
+            with open(os.path.join(tmpDir, 'film%04d.htm' % i), 'wb') as f :
+                # some real pages start with an XML declaration, which lxml
+                # refuses in unicode strings
+                if i % 2 == 1 : f.write('<?xml version="1.0" encoding="iso-8859-1"?>\n')
+                f.write(make_box_office_html(n_weeks, i))
+        # read saved pages as the scraper gets them: decoded as requests does by default
+        pages = []
+        for fileName in sorted(os.listdir(tmpDir)) :
+            with open(os.path.join(tmpDir, fileName), 'rb') as f :
+                pages.append(f.read().decode('iso-8859-1'))
+    finally :
+        shutil.rmtree(tmpDir)
+    print "\nINFO: CHART PARSING,", n_pages, "pages,", sum(len(p) for p in pages) // n_pages, "bytes each"
+
+    with warnings.catch_warnings() :
+        warnings.simplefilter('ignore')
+        start = time.time()
+        old = [_parse_film_weekly_reference(page) for page in pages]
+        t_old = time.time() - start
+    print "... old parser (bs4, default parser, re.sub per cell) = %.3f s" % t_old
+    backend = bom.lxml
+    try :
+        for label, lxml in [('lxml', backend), ('bs4 fallback', None)] :
+            if label == 'lxml' and lxml is None : continue
+            bom.lxml = lxml
+            start = time.time()
+            new = [bom.parse_film_weekly_box_office(page) for page in pages]
+            t_new = time.time() - start
+            print "... parse_film_weekly_box_office, %s = %.3f s (%.1fx), identical = %s" % (
+                label, t_new, t_old / t_new, check_identical('chart_parsing', new == old and
+                    all(isinstance(cell, unicode) for rows in new for row in rows for cell in row)))
+    finally :
+        bom.lxml = backend
+    start = time.time()
+    typed = [bom.parse_film_weekly_box_office(page, typed=True) for page in pages]
+    print "... typed rows = %.3f s, e.g." % (time.time() - start), typed[0][1]
+
+
+################################################################################
+def benchmark_index(n_docs=20000, n_paras=20) :
+    """Compares getting one document by reparsing a whole LexisNexis export
+    against building its index once and then looking documents up in it.
+    """
+    tmpDir = tempfile.mkdtemp()
+    try :
+        inFileName = os.path.join(tmpDir, 'export.txt')
+        with open(inFileName, 'wb') as f :
+            f.write(make_lexis_nexis_export(n_docs, n_paras))
+        print "\nINFO: INDEX,", n_docs, "docs,", os.path.getsize(inFileName) // 1000000, "MB"
+        k = n_docs * 3 // 4
+
+        def reparse() :
+            with open(inFileName, 'r') as inFile :
+                return next(itertools.islice(my_new_module.iter_lexis_nexis_docs(inFile), k, None))
+        start = time.time()
+        row = reparse()
+        print "... reparse up to document %d = %.3f s" % (k, time.time() - start)
+
+        start = time.time()
+        index = my_new_module.LexisNexisIndex(inFileName)
+        print "... build index = %.3f s, %d bytes" % (time.time() - start,
+            os.path.getsize(inFileName + my_new_module.INDEX_EXTENSION))
+        index.close()
+        start = time.time()
+        index = my_new_module.LexisNexisIndex(inFileName)
+        t_open = time.time() - start
+        ks = random.Random(0).sample(xrange(n_docs), 1000)
+        start = time.time()
+        for j in ks : index.get(j)
+        t_get = (time.time() - start) / len(ks)
+        print "... open index = %.2f ms, get = %.2f ms, identical = %s" % (
+            t_open * 1000, t_get * 1000, check_identical('index', index.get(k) == row))
+        index.filter()    # imports numpy, outside of the timing
+        start = time.time()
+        ks = index.filter(pub='The New York Times', section=lambda s: s != 'NA')
+        t_filter = time.time() - start
+        expected = [k for k in xrange(len(index)) if index.get_value(k, 'pub') == 'The New York Times'
+                    and index.get_value(k, 'section') != 'NA']
+        print "... filter = %.2f ms, %d docs, identical = %s" % (t_filter * 1000, len(ks),
+            check_identical('index filter', ks == expected))
+        index.close()
+    finally :
+        shutil.rmtree(tmpDir)
+
+
+################################################################################
+def benchmark_pub_dates(n_docs=20000, n_paras=20) :
+    """Compares parsing every document of a LexisNexis export and filtering by
+    ISO pub date afterwards against skipping out-of-range documents in the parse
+    loop, for a one-month range.
+    """
+    export = make_lexis_nexis_export(n_docs, n_paras)
+    print "\nINFO: PUB DATES,", n_docs, "docs"
+    def parse_then_filter() :
+        rows = my_new_module.iter_lexis_nexis_docs(cStringIO.StringIO(export))
+        return [row for row in rows if '2012-03-01' <= row['pub_date_iso'] <= '2012-03-31']
+    def filter_in_loop() :
+        return list(my_new_module.iter_lexis_nexis_docs(cStringIO.StringIO(export),
+            date_from='2012-03-01', date_to='2012-03-31'))
+    t_after = best_time(parse_then_filter, repeat=1)
+    t_loop = best_time(filter_in_loop, repeat=1)
+    print "... parse all, then filter = %.3f s" % t_after
+    print "... filter in parse loop = %.3f s (%.1fx), identical = %s" % (
+        t_loop, t_after / t_loop, check_identical('pub_dates', parse_then_filter() == filter_in_loop()))
+    dates = [row['pub_date'] for row in parse_then_filter()]
+    cache = my_new_module._pub_dates
+    def parse_uncached() :
+        for date in dates :
+            cache.clear()
+            my_new_module.parse_pub_date(date)
+    t_cold = best_time(parse_uncached)
+    t_warm = best_time(lambda: [my_new_module.parse_pub_date(date) for date in dates])
+    print "... parse_pub_date: uncached = %.2f us, memoized = %.2f us per date" % (
+        t_cold / len(dates) * 1e6, t_warm / len(dates) * 1e6)
+
+
+################################################################################
+def benchmark_dedup(n_stories=2000, n_words=300) :
+    """Times MinHash signatures, batched and one text at a time, LSH lookups
+    against all-pairs comparison, and NLP stages after dropping near-duplicates
+    against running them on every text of a corpus with syndicated copies.
+    """
+    texts, stories = make_syndicated_texts(n_stories, n_words)
+    print "\nINFO: DEDUP,", len(texts), "texts,", n_stories, "stories"
+
+    minhasher = bjd_nlp.MinHasher()
+    t_single = best_time(lambda: [minhasher.signature(text) for text in texts], repeat=1)
+    start = time.time()
+    sigs, counts = minhasher.signatures(texts)
+    t_batch = time.time() - start
+    print "... signatures: one at a time = %.3f s, batched = %.3f s" % (t_single, t_batch)
+
+    index = bjd_nlp.NearDuplicateIndex(0.7)
+    start = time.time()
+    for key, sig, count in itertools.izip(xrange(len(texts)), sigs, counts) :
+        index.add(key, sig, count)
+    t_lsh = time.time() - start
+    # all pairs, vectorized per text, on a sample
+    n_sample = min(len(texts), 500)
+    start = time.time()
+    for i in xrange(n_sample) : (sigs[:i] == sigs[i]).mean(axis=1) >= 0.7
+    t_pairs = (time.time() - start) * (len(texts) / float(n_sample)) ** 2
+    report = index.report()
+    print "... LSH = %.3f s (%d comparisons), all pairs (extrapolated) = %.3f s (%d)" % (
+        t_lsh, report['comparisons'], t_pairs, len(texts) * (len(texts) - 1) // 2)
+
+    def nlp(texts) :
+        for text in bjd_nlp._text_cleaner.clean_many(texts) :
+            bjd_nlp.stem_words(text.split())
+    bjd_nlp.get_stemmer().clear()
+    t_all = best_time(nlp, (texts,), repeat=1)
+    bjd_nlp.get_stemmer().clear()
+    start = time.time()
+    index = bjd_nlp.NearDuplicateIndex(0.7)
+    kept = list(bjd_nlp.dedup_docs(texts, index=index))
+    nlp(kept)
+    t_dedup = time.time() - start
+    report = index.report()
+    kept_texts = set(kept)
+    lost = n_stories - len(set(story for text, story in itertools.izip(texts, stories)
+                                if text in kept_texts))
+    print "... clean + stem all = %.3f s; dedup, then clean + stem = %.3f s" % (t_all, t_dedup)
+    print "... kept %d texts (%d stories), %.0f%% of texts and %.0f%% of shingles saved, %d stories lost" % (
+        len(kept), n_stories, 100 * report['texts_saved'], 100 * report['shingles_saved'], lost)
+
+
+################################################################################
+def benchmark_instrumentation(n_docs=2000, n_calls=100000) :
+    """Measures the overhead of the timers and counters wrapped around every
+    public function, per call and on a whole parse + clean + stem pipeline,
+    with instrumentation enabled and disabled.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    inFileName = os.path.join(tmp_dir, 'export.txt')
+    with open(inFileName, 'w') as f : f.write(make_lexis_nexis_export(n_docs))
+    print "\nINFO: INSTRUMENTATION,", n_docs, "documents,", n_calls, "calls"
+
+    def noop() : pass
+    timed_noop = instrumentation.timed('noop')(noop)
+    def calls(func) :
+        for i in xrange(n_calls) : func()
+    def pipeline() :
+        with open(inFileName) as f :
+            for doc in my_new_module.iter_lexis_nexis_docs(f) :
+                text = bjd_nlp.clean_text(doc['article_text'])
+                bjd_nlp.stem_words(text.split())
+
+    try :
+        t_raw = best_time(calls, (noop,))
+        times = {}
+        for enabled in (False, True) :
+            if enabled : instrumentation.enable()
+            else : instrumentation.disable()
+            times[enabled] = (best_time(calls, (timed_noop,)) - t_raw, best_time(pipeline, repeat=3))
+        instrumentation.reset()
+        pipeline()
+        stats = instrumentation.summary()
+    finally :
+        instrumentation.enable()
+        shutil.rmtree(tmp_dir)
+    print "... per call overhead: disabled = %.2f us, enabled = %.2f us" % (
+        1e6 * times[False][0] / n_calls, 1e6 * times[True][0] / n_calls)
+    print "... pipeline: disabled = %.3f s, enabled = %.3f s, overhead = %.1f%%" % (
+        times[False][1], times[True][1], 100 * (times[True][1] / times[False][1] - 1))
+    print "... top timers by self time:", ', '.join('%s %.3f s' % (name, timer['self_seconds'])
+        for name, timer in stats['timers'].items()[:3])
+    print "... counters:", ', '.join('%s = %d' % item for item in sorted(stats['counters'].items()))
+
+
+################################################################################
+def benchmark_import_time(repeat=5) :
+    """Compares the time to start python and import bjd_nlp against importing it
+    along with the matplotlib, nltk and numpy it used to import up front, and
+    times the first calls that now import them, each in a fresh process.
+    """
+    def run(code) :
+        # best of repeat runs in fresh processes, interpreter startup included
+        times = []
+        for i in xrange(repeat) :
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', code],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.time() - start)
+        return min(times)
+
+    print "\nINFO: IMPORT TIME, best of", repeat, "fresh processes"
+    t_python = run('pass')
+    t_lazy = run('import bjd_nlp')
+    t_eager = run('import matplotlib.pyplot, nltk, numpy; import bjd_nlp')
+    print "... python alone = %.3f s" % t_python
+    print "... import bjd_nlp = %.3f s, with matplotlib, nltk and numpy (as before) = %.3f s, %.1fx faster" % (
+        t_lazy, t_eager, (t_eager - t_python) / max(t_lazy - t_python, 1e-3))
+    for label, code in [('clean_text', "bjd_nlp.clean_text('Some text 2012')"),
+                        ('bag_of_words', "bjd_nlp.bag_of_words(['some', 'words'])"),
+                        ('get_nbest_ngrams (numpy, nltk)',
+                         "bjd_nlp.get_nbest_ngrams('a b c a b c'.split(), 2)"),
+                        ('plot_barh_chart, headless',
+                         "import cStringIO; bjd_nlp.plot_barh_chart({'a': 2, 'b': 1}, 2, "
+                         "fileName=cStringIO.StringIO(), format='png')")] :
+        print "... import bjd_nlp + first %s = %.3f s" % (label, run('import bjd_nlp; ' + code))
+
+
+################################################################################
+def get_suite_cases(tmp_dir, cleanups) :
+    """Cases of the benchmark suite, as (name, base size, unit, setup), where
+    setup(size) deterministically generates inputs of size units, writing any
+    files in tmp_dir, and returns a function running the case on them. Names
+    are timer names of the functions timed (see instrumentation). Functions
+    to call once the suite is done, e.g. to stop servers, go in cleanups.
+    """
+    import box_office_mojo_scraper
+
+    def each(func, items) :
+        return lambda: [func(item) for item in items]
+    def docs(n_tokens, doc_length=300) :
+        tokens = make_zipf_tokens(n_tokens)
+        return [tokens[i:i + doc_length] for i in xrange(0, n_tokens, doc_length)]
+    def export_file(n_docs) :
+        fileName = os.path.join(tmp_dir, 'export_%d.txt' % n_docs)
+        if not os.path.isfile(fileName) :
+            with open(fileName, 'w') as f : f.write(make_lexis_nexis_export(n_docs))
+        return fileName
+    def chunks(n_docs) :
+        return list(my_new_module.iter_lexis_nexis_chunks(
+            cStringIO.StringIO(make_lexis_nexis_export(n_docs))))[1:]
+
+    def clean_many(n) :
+        texts = make_news_texts(n)
+        return lambda: list(bjd_nlp.TextCleaner().clean_many(texts))
+    def stem_words(n) :
+        tokens = make_zipf_tokens(n)
+        def run() :
+            bjd_nlp.get_stemmer().clear()
+            bjd_nlp.stem_words(tokens)
+        return run
+    def nbest(func, **kwargs) :
+        def setup(n) :
+            tokens = make_zipf_tokens(n)
+            return lambda: func(tokens, **kwargs)
+        return setup
+    def collocation_counter(n) :
+        texts = docs(n)
+        def run() :
+            counter = bjd_nlp.CollocationCounter(2)
+            for words in texts : counter.update(words)
+            counter.nbest()
+        return run
+    def collocation_counter_merge(n) :
+        counters = []
+        for words in docs(n) :
+            counters.append(bjd_nlp.CollocationCounter(2))
+            counters[-1].update(words)
+        def run() :
+            total = bjd_nlp.CollocationCounter(2)
+            for counter in counters : total.merge(counter)
+        return run
+    def collocation_counter_save(n) :
+        counter = bjd_nlp.CollocationCounter(2)
+        for words in docs(n) : counter.update(words)
+        fileName = os.path.join(tmp_dir, 'counter.pkl')
+        def run() :
+            counter.save(fileName)
+            bjd_nlp.CollocationCounter.load(fileName)
+        return run
+    def lru_cache(n) :
+        tokens = make_zipf_tokens(n)
+        def run() :
+            cache = bjd_nlp.LRUCache(len, maxsize=1000)
+            for token in tokens : cache(token)
+            cache.info()
+        return run
+    def add_stopwords(n) :
+        tokens = make_zipf_tokens(n)
+        return lambda: bjd_nlp.add_stopwords(tokens)
+    def get_tagger(n) :
+        def run() :
+            bjd_nlp._tagger = None
+            bjd_nlp.get_tagger()
+        return run
+    def tag_texts(n) :
+        return [' '.join(words) + '.' for words in docs(n * 100, 100)]
+    def syndicated(n) :
+        return make_syndicated_texts(n)[0][:n]
+    def minhash_signatures(n) :
+        texts = syndicated(n)
+        return lambda: bjd_nlp.MinHasher().signatures(texts)
+    def near_duplicate_index(n) :
+        texts = syndicated(n)
+        def run() :
+            index = bjd_nlp.NearDuplicateIndex()
+            index.add_texts(xrange(len(texts)), texts)
+            index.report()
+        return run
+    def dedup_docs(n) :
+        texts = syndicated(n)
+        return lambda: list(bjd_nlp.dedup_docs(texts))
+    def corpus(n) :
+        from nltk.corpus.reader import CategorizedPlaintextCorpusReader
+        corpus_dir = os.path.join(tmp_dir, 'corpus_%d' % n)
+        if not os.path.isdir(corpus_dir) :
+            os.mkdir(corpus_dir)
+            for i, words in enumerate(docs(n)) :
+                with open(os.path.join(corpus_dir, 'cat%d_%05d.txt' % (i % 2, i)), 'w') as f :
+                    f.write(' '.join(words))
+        return CategorizedPlaintextCorpusReader(corpus_dir, r'cat.*\.txt',
+                                                cat_pattern=r'(cat\d)_.*')
+    def label_features_from_corpus(n) :
+        reader = corpus(n)
+        return lambda: bjd_nlp.get_label_features_from_corpus(reader)
+    def label_matrix_from_corpus(n) :
+        reader = corpus(n)
+        return lambda: bjd_nlp.get_label_matrix_from_corpus(reader)
+    def matrix_to_featuresets(n) :
+        matrix, vocabulary = bjd_nlp.bag_of_words_matrix(docs(n))
+        return lambda: list(bjd_nlp.matrix_to_featuresets(matrix, vocabulary))
+    def plot(func, name) :
+        # saved to a file, so drawn with the Agg backend, without a display
+        def setup(n) :
+            fd = collections.OrderedDict(collections.Counter(make_zipf_tokens(100 * n)).most_common(n))
+            fileName = os.path.join(tmp_dir, name + '.png')
+            return lambda: func(fd, ylim=n, fileName=fileName)
+        return setup
+    def tagged_sents(n) :
+        tags = itertools.cycle(['DT', 'JJ', 'NN', 'VBD', 'IN', 'DT', 'NNS', 'RB', 'VBZ', 'NN'])
+        return [zip(words, tags) for words in docs(n, 20)]
+    def chunk_many(n) :
+        sents = tagged_sents(n)
+        return lambda: list(bjd_nlp.chunk_many(sents))
+    def register_chunk_grammar(n) :
+        sents = tagged_sents(n)
+        def run() :
+            bjd_nlp.register_chunk_grammar('suite', 'NP: {<DT>?<JJ>*<NN.*>+}')
+            list(bjd_nlp.chunk_many(sents, grammar='suite'))
+        return run
+    def labeled(n) :
+        return {'pos': [{'w%d' % i: True} for i in xrange(0, n, 2)],
+                'neg': [{'w%d' % i: True} for i in xrange(1, n, 2)]}
+    def split_label_features(n) :
+        label_features = labeled(n)
+        return lambda: bjd_nlp.split_label_features(label_features)
+    def iter_split_label_features(n) :
+        label_features = labeled(n)
+        return lambda: list(bjd_nlp.iter_split_label_features(label_features))
+    def kfold_label_features(n) :
+        label_features = labeled(n)
+        def run() :
+            for train, test in bjd_nlp.kfold_label_features(label_features, 5) :
+                for instance in train : pass
+        return run
+    def pub_dates(n) :
+        rand = random.Random(0)
+        return ['%s %d, %d Monday' % (rand.choice(my_new_module.MONTHS), rand.randint(1, 28),
+                                      rand.randint(2000, 2012)) for i in xrange(n)]
+    def iter_lexis_nexis_chunks(n) :
+        export = make_lexis_nexis_export(n)
+        return lambda: list(my_new_module.iter_lexis_nexis_chunks(cStringIO.StringIO(export)))
+    def iter_lexis_nexis_docs(n) :
+        export = make_lexis_nexis_export(n)
+        return lambda: list(my_new_module.iter_lexis_nexis_docs(cStringIO.StringIO(export)))
+    def register_lexis_nexis_field(n) :
+        docs = chunks(n)
+        def run() :
+            my_new_module.register_lexis_nexis_field('DATELINE: ', 'dateline')
+            for doc in docs : my_new_module.parse_lexis_nexis_doc(doc)
+        return run
+    def print_lexis_nexis_doc(n) :
+        rows = [my_new_module.parse_lexis_nexis_doc(doc) for doc in chunks(n)]
+        def run() :
+            stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+            try :
+                for row in rows : my_new_module.print_lexis_nexis_doc(row)
+            finally :
+                sys.stdout = stdout
+        return run
+    def tsv_writer(n) :
+        rows = [my_new_module.parse_lexis_nexis_doc(doc) for doc in chunks(n)]
+        outFileName = os.path.join(tmp_dir, 'rows.tsv')
+        def run() :
+            out = my_new_module.TSVWriter(outFileName)
+            for row in rows : out.writerow(row)
+            out.flush()
+            out.close()
+        return run
+    def parse_lexis_nexis(writer) :
+        def setup(n) :
+            inFileName = export_file(n)
+            outFileName = os.path.join(tmp_dir, 'parsed.' + writer)
+            return lambda: my_new_module.parse_lexis_nexis(inFileName, outFileName, writer=writer)
+        return setup
+    def read_lexis_nexis_parquet(n) :
+        outFileName = os.path.join(tmp_dir, 'read_%d.parquet' % n)
+        my_new_module.parse_lexis_nexis(export_file(n), outFileName, writer='parquet')
+        return lambda: my_new_module.read_lexis_nexis_parquet(outFileName)
+    def parse_lexis_nexis_batch(n) :
+        # the same documents, in 10 files
+        export = make_lexis_nexis_export(n)
+        docs_dir = os.path.join(tmp_dir, 'batch_%d' % n)
+        os.mkdir(docs_dir)
+        chunks = export.split('\r\n\r\n', 1)[1].split(' of %d DOCUMENTS' % n)
+        step = len(chunks) // 10 + 1
+        for i in xrange(0, len(chunks), step) :
+            with open(os.path.join(docs_dir, 'export_%02d.txt' % (i // step)), 'w') as f :
+                f.write('Download Request\r\n\r\n' + ' of %d DOCUMENTS'.join(chunks[i:i + step]))
+        outFileName = os.path.join(tmp_dir, 'batch_out_%d' % n)
+        def run() :
+            if os.path.isdir(outFileName) : shutil.rmtree(outFileName)
+            my_new_module.parse_lexis_nexis_batch(os.path.join(docs_dir, '*.txt'), outFileName,
+                                                  os.path.join(tmp_dir, 'manifest.json'), shard=True)
+            os.remove(os.path.join(tmp_dir, 'manifest.json'))
+        return run
+    def build_lexis_nexis_index(n) :
+        inFileName = export_file(n)
+        indexFileName = os.path.join(tmp_dir, 'export.idx')
+        return lambda: my_new_module.build_lexis_nexis_index(inFileName, indexFileName)
+    def lexis_nexis_index_get(n) :
+        index = my_new_module.LexisNexisIndex(export_file(n))
+        return lambda: [index.get(k) for k in xrange(len(index))]
+    def lexis_nexis_index_open(n) :
+        inFileName = export_file(n)
+        my_new_module.LexisNexisIndex(inFileName).close()
+        return lambda: my_new_module.LexisNexisIndex(inFileName).close()
+    def lexis_nexis_index_filter(n) :
+        index = my_new_module.LexisNexisIndex(export_file(n))
+        return lambda: list(index.iter_docs(index.filter(
+            pub_date_iso=lambda d: '2012-03-01' <= d <= '2012-03-31')))
+    def chart_pages(n) :
+        return [make_box_office_html(seed=i) for i in xrange(n)]
+    def chart_rows(n) :
+        rows = []
+        for html in chart_pages(n // 52 + 1) :
+            rows.extend(box_office_mojo_scraper.parse_film_weekly_box_office(html))
+        return rows[:n]
+    def stub_films(n) :
+        film_ids = ['film%04d' % i for i in xrange(n)]
+        pages = dict(('/movies/?page=weekly&id=%s.htm' % film_id, make_box_office_html(52, i))
+                     for i, film_id in enumerate(film_ids))
+        server = serve_stub_pages(pages)
+        cleanups.append(server.shutdown)
+        return film_ids, 'http://127.0.0.1:%d/movies' % server.server_port
+    def film_weekly_box_office(n) :
+        film_ids, base_url = stub_films(n)
+        def run() :
+            fetcher = box_office_mojo_scraper.Fetcher()
+            try :
+                for film_id in film_ids :
+                    box_office_mojo_scraper.get_film_weekly_box_office(
+                        film_id, csv.writer(cStringIO.StringIO()), fetcher, base_url)
+                fetcher.summary()
+            finally :
+                fetcher.close()
+        return run
+    def token_bucket(n) :
+        def run() :
+            bucket = box_office_mojo_scraper.TokenBucket(1e9, capacity=n)
+            for i in xrange(n) : bucket.acquire()
+        return run
+    def scrape_films(n) :
+        film_ids, base_url = stub_films(n)
+        outFilePattern = os.path.join(tmp_dir, 'film_%s.txt')
+        cache_dir = os.path.join(tmp_dir, 'cache_%d' % n)
+        # half from a revalidated cache, half downloaded
+        box_office_mojo_scraper.scrape_films(film_ids[::2], outFilePattern, base_url,
+                                             cache_dir=cache_dir, ttl=0)
+        return lambda: box_office_mojo_scraper.scrape_films(film_ids, outFilePattern, base_url,
+                                                            cache_dir=cache_dir, ttl=0)
+
+    return [
+        ('bjd_nlp.remove_non_ascii', 2000, 'texts',
+            lambda n: each(bjd_nlp.remove_non_ascii, make_news_texts(n))),
+        ('bjd_nlp.remove_URLs', 2000, 'texts',
+            lambda n: each(bjd_nlp.remove_URLs, make_news_texts(n))),
+        ('bjd_nlp.clean_text', 2000, 'texts',
+            lambda n: each(bjd_nlp.clean_text, make_news_texts(n))),
+        ('bjd_nlp.TextCleaner.clean_many', 2000, 'texts', clean_many),
+        ('bjd_nlp.stem_words', 100000, 'tokens', stem_words),
+        ('bjd_nlp.get_nbest_bigrams', 50000, 'tokens', nbest(bjd_nlp.get_nbest_bigrams)),
+        ('bjd_nlp.get_nbest_trigrams', 50000, 'tokens', nbest(bjd_nlp.get_nbest_trigrams)),
+        ('bjd_nlp.get_nbest_ngrams', 100000, 'tokens', nbest(bjd_nlp.get_nbest_ngrams, n=2)),
+        ('bjd_nlp.CollocationCounter', 100000, 'tokens', collocation_counter),
+        ('bjd_nlp.CollocationCounter.merge', 100000, 'tokens', collocation_counter_merge),
+        ('bjd_nlp.CollocationCounter.save', 100000, 'tokens', collocation_counter_save),
+        ('bjd_nlp.LRUCache', 100000, 'tokens', lru_cache),
+        ('bjd_nlp.add_stopwords', 100000, 'tokens', add_stopwords),
+        ('bjd_nlp.get_tagger', 1, 'taggers', get_tagger),
+        ('bjd_nlp.tokenize_and_tag', 100, 'texts',
+            lambda n: each(bjd_nlp.tokenize_and_tag, tag_texts(n))),
+        ('bjd_nlp.tokenize_and_tag_many', 100, 'texts',
+            lambda n: (lambda texts: lambda: list(bjd_nlp.tokenize_and_tag_many(texts)))(tag_texts(n))),
+        ('bjd_nlp.bag_of_words', 100000, 'tokens', lambda n: each(bjd_nlp.bag_of_words, docs(n))),
+        ('bjd_nlp.bag_of_words_matrix', 100000, 'tokens',
+            lambda n: (lambda texts: lambda: bjd_nlp.bag_of_words_matrix(texts))(docs(n))),
+        ('bjd_nlp.matrix_to_featuresets', 100000, 'tokens', matrix_to_featuresets),
+        ('bjd_nlp.get_label_features_from_corpus', 30000, 'tokens', label_features_from_corpus),
+        ('bjd_nlp.get_label_matrix_from_corpus', 30000, 'tokens', label_matrix_from_corpus),
+        ('bjd_nlp.MinHasher.signatures', 1000, 'texts', minhash_signatures),
+        ('bjd_nlp.MinHasher.signature', 200, 'texts',
+            lambda n: each(bjd_nlp.MinHasher().signature, syndicated(n))),
+        ('bjd_nlp.NearDuplicateIndex', 1000, 'texts', near_duplicate_index),
+        ('bjd_nlp.dedup_docs', 1000, 'texts', dedup_docs),
+        ('bjd_nlp.regex_chunker', 20000, 'tokens', lambda n: each(bjd_nlp.regex_chunker, tagged_sents(n))),
+        ('bjd_nlp.chunk_many', 20000, 'tokens', chunk_many),
+        ('bjd_nlp.register_chunk_grammar', 20000, 'tokens', register_chunk_grammar),
+        ('bjd_nlp.split_label_features', 50000, 'featuresets', split_label_features),
+        ('bjd_nlp.iter_split_label_features', 50000, 'featuresets', iter_split_label_features),
+        ('bjd_nlp.kfold_label_features', 10000, 'featuresets', kfold_label_features),
+        ('bjd_nlp.plot_freq_dist', 20, 'words', plot(bjd_nlp.plot_freq_dist, 'plot_freq_dist')),
+        ('bjd_nlp.plot_barh_chart', 20, 'words', plot(bjd_nlp.plot_barh_chart, 'plot_barh_chart')),
+        ('my_new_module.parse_pub_date', 100000, 'dates',
+            lambda n: each(my_new_module.parse_pub_date, pub_dates(n))),
+        ('my_new_module.iter_lexis_nexis_chunks', 1000, 'docs', iter_lexis_nexis_chunks),
+        ('my_new_module.parse_lexis_nexis_doc', 1000, 'docs',
+            lambda n: each(my_new_module.parse_lexis_nexis_doc, chunks(n))),
+        ('my_new_module.iter_lexis_nexis_docs', 1000, 'docs', iter_lexis_nexis_docs),
+        ('my_new_module.register_lexis_nexis_field', 1000, 'docs', register_lexis_nexis_field),
+        ('my_new_module.print_lexis_nexis_doc', 1000, 'docs', print_lexis_nexis_doc),
+        ('my_new_module.TSVWriter', 1000, 'docs', tsv_writer),
+        ('my_new_module.parse_lexis_nexis', 1000, 'docs', parse_lexis_nexis('tsv')),
+        ('my_new_module.parse_lexis_nexis, parquet', 1000, 'docs', parse_lexis_nexis('parquet')),
+        ('my_new_module.read_lexis_nexis_parquet', 1000, 'docs', read_lexis_nexis_parquet),
+        ('my_new_module.parse_lexis_nexis_batch', 1000, 'docs', parse_lexis_nexis_batch),
+        ('my_new_module.build_lexis_nexis_index', 1000, 'docs', build_lexis_nexis_index),
+        ('my_new_module.LexisNexisIndex.get', 1000, 'docs', lexis_nexis_index_get),
+        ('my_new_module.LexisNexisIndex.close', 1000, 'docs', lexis_nexis_index_open),
+        ('my_new_module.LexisNexisIndex.filter', 1000, 'docs', lexis_nexis_index_filter),
+        ('box_office_mojo_scraper.parse_film_weekly_box_office', 20, 'pages',
+            lambda n: each(box_office_mojo_scraper.parse_film_weekly_box_office, chart_pages(n))),
+        ('box_office_mojo_scraper.type_weekly_box_office_row', 10000, 'rows',
+            lambda n: each(box_office_mojo_scraper.type_weekly_box_office_row, chart_rows(n))),
+        ('box_office_mojo_scraper.get_film_weekly_box_office', 20, 'films', film_weekly_box_office),
+        ('box_office_mojo_scraper.TokenBucket.acquire', 10000, 'tokens', token_bucket),
+        ('box_office_mojo_scraper.scrape_films', 20, 'films', scrape_films),
+        ]
+
+
+################################################################################
+def _run_case(func, repeat, conn) :
+    """Runs a suite case in a forked process, whose peak memory starts out at
+    the parent's current memory, sending back its best time, the growth of its
+    peak memory in MB and the names of all timed functions it called, or the
+    error it raised, as a string (LookupError if NLTK data is missing).
+    """
+    try :
+        instrumentation.reset()
+        before = instrumentation.peak_memory()
+        seconds = best_time(func, repeat=repeat)
+        conn.send((seconds, instrumentation.peak_memory() - before,
+                   list(instrumentation.summary()['timers'])))
+    except Exception as error :
+        conn.send('%s: %s' % (type(error).__name__, error))
+    conn.close()
+
+
+################################################################################
+def _iter_public_names(module) :
+    """Yields timer names of all public functions and public methods of public
+    classes defined in module that instrument_module times, i.e. not excluded.
+    """
+    for name, obj in sorted(vars(module).items()) :
+        if name.startswith('_') or getattr(obj, '__module__', None) != module.__name__ : continue
+        if inspect.isfunction(obj) and hasattr(obj, '__wrapped__') :
+            yield '%s.%s' % (module.__name__, name)
+        elif inspect.isclass(obj) and not issubclass(obj, BaseException) :
+            for attr, method in sorted(vars(obj).items()) :
+                if not attr.startswith('_') and hasattr(method, '__wrapped__') :
+                    yield '%s.%s.%s' % (module.__name__, name, attr)
+
+
+################################################################################
+def benchmark_suite(scale=1, n_sizes=3, repeat=3, cases=None, save=None, baseline=None,
+                    tolerance=20) :
+    """Times every suite case (see get_suite_cases) at n_sizes input sizes, each
+    twice the last, recording throughput and peak memory growth, and reports
+    which public functions no case called, and which only skipped cases would
+    have called, with the reason they were skipped. Results can be saved as JSON and
+    compared against a saved baseline, which flags cases more than tolerance
+    percent slower as regressions. Each case runs in a forked process, so peak
+    memory is its own. Returns the number of regressions and failed cases,
+    e.g. ones raising an error.
+    @param scale: Multiplier of the base sizes of all cases
+    @param cases: Comma-separated substrings of names of the only cases to run
+    @param save: JSON file to save results to
+    @param baseline: JSON file of earlier results to compare against
+    """
+    import box_office_mojo_scraper
+    # imported by bjd_nlp only when first used, but not to be timed in every
+    # forked case (see benchmark_import_time for that)
+    import nltk
+    import numpy
+    import scipy.sparse
+    tmp_dir = tempfile.mkdtemp()
+    cleanups = []
+    suite = get_suite_cases(tmp_dir, cleanups)
+    if cases is not None :
+        suite = [case for case in suite if any(c in case[0] for c in cases.split(','))]
+    base = None
+    if baseline is not None :
+        with open(baseline) as f : base = json.load(f)
+        if base['scale'] != scale : print "WARNING: baseline scale is", base['scale']
+    print "\nINFO: SUITE,", len(suite), "cases,", n_sizes, "sizes, scale =", scale
+    results = collections.OrderedDict()
+    regressions = []
+    failures = []
+    # names of cases that could not run here, e.g. without NLTK data, by reason
+    skipped = collections.OrderedDict()
+    covered = set()
+    try :
+        for name, size, unit, setup in suite :
+            results[name] = collections.OrderedDict()
+            for k in xrange(n_sizes) :
+                n = size * scale * 2 ** k
+                try :
+                    func = setup(n)
+                except Exception as error :
+                    result = '%s: %s' % (type(error).__name__, error)
+                else :
+                    receiver, sender = multiprocessing.Pipe(False)
+                    process = multiprocessing.Process(target=_run_case, args=(func, repeat, sender))
+                    process.start()
+                    # only the child may write, so a child dying without a word ends recv()
+                    sender.close()
+                    try :
+                        result = receiver.recv()
+                    except EOFError :
+                        result = None
+                    receiver.close()
+                    process.join()
+                    if result is None : result = 'exited with code %s' % process.exitcode
+                if isinstance(result, basestring) :
+                    if result.startswith('LookupError') :
+                        print "... %s: skipped, NLTK data not installed" % name
+                        skipped.setdefault('NLTK data not installed', []).append(name.split(',')[0])
+                    else :
+                        print "... %s, %d %s: FAILED, %s" % (name, n, unit, result)
+                        failures.append((name, n))
+                    break
+                seconds, peak_mb, timers = result
+                covered.update(timers)
+                results[name][str(n)] = {'n': n, 'unit': unit, 'seconds': seconds,
+                                         'per_second': n / seconds, 'peak_mb': peak_mb}
+                line = "... %s, %d %s = %.4f s, %.0f %s/s, peak +%.1f MB" % (
+                    name, n, unit, seconds, n / seconds, unit, peak_mb)
+                old = base['results'].get(name, {}).get(str(n)) if base is not None else None
+                if old is not None :
+                    change = 100 * (seconds / old['seconds'] - 1)
+                    line += ", %+.0f%% vs baseline" % change
+                    # timer noise alone can make the fastest cases miss by a few ms
+                    if change > tolerance and seconds - old['seconds'] > 0.01 :
+                        line += " REGRESSION"
+                        regressions.append((name, n))
+                print line
+    finally :
+        for cleanup in cleanups : cleanup()
+        shutil.rmtree(tmp_dir)
+
+    # functions called by the cases count, e.g. parse_lexis_nexis_doc by parse_lexis_nexis
+    if cases is None :
+        public = [name for module in (bjd_nlp, my_new_module, box_office_mojo_scraper)
+                  for name in _iter_public_names(module)]
+        missing = [name for name in public if name not in covered]
+        print "... %d of %d public functions timed" % (len(public) - len(missing), len(public))
+        for reason, names in skipped.iteritems() :
+            print "... skipped, %s: %s" % (reason, ', '.join(name for name in names if name in missing))
+            missing = [name for name in missing if name not in names]
+        if missing : print "... not timed: %s" % ', '.join(missing)
+    if failures :
+        print "... %d cases failed" % len(failures)
+    if base is not None :
+        print "... %d regressions vs %s (python %s)" % (len(regressions), baseline, base['python'])
+    if save is not None :
+        with open(save, 'w') as f :
+            json.dump({'python': sys.version.split()[0], 'platform': sys.platform,
+                       'scale': scale, 'n_sizes': n_sizes, 'repeat': repeat,
+                       'results': results}, f, indent=1)
+        print "... results saved to", save
+    return len(regressions) + len(failures)
+
+
+BENCHMARKS = {
+    'header_dispatch': benchmark_header_dispatch,
+    'parse_workers': benchmark_parse_workers,
+    'columnar': benchmark_columnar,
+    'clean_text': benchmark_clean_text,
+    'stopwords': benchmark_stopwords,
+    'ngrams': benchmark_ngrams,
+    'tagging': benchmark_tagging,
+    'pool_errors': benchmark_pool_errors,
+    'stemming': benchmark_stemming,
+    'features': benchmark_features,
+    'label_features': benchmark_label_features,
+    'split': benchmark_split,
+    'scraper': benchmark_scraper,
+    'chart_parsing': benchmark_chart_parsing,
+    'index': benchmark_index,
+    'pub_dates': benchmark_pub_dates,
+    'dedup': benchmark_dedup,
+    'instrumentation': benchmark_instrumentation,
+    'import_time': benchmark_import_time,
+    'suite': benchmark_suite,
+    }
+
+
+if __name__ == '__main__' :
+    # run options formatted as key=value; all but 'which' and the file names
+    # and case names of the suite are passed as ints to whichever of the
+    # selected benchmarks accept them
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    which = sorted(BENCHMARKS)
+    kwargs = {}
+    for arg in sys.argv[1:] :
+        key, val = arg.split('=')
+        if key == 'which' : which = val.split(',')
+        elif key in ('cases', 'save', 'baseline') : kwargs[key] = val
+        else : kwargs[key] = int(val)
+    failures = 0
+    for name in which :
+        argnames = inspect.getargspec(BENCHMARKS[name]).args
+        failures += BENCHMARKS[name](**dict((k, v) for k, v in kwargs.items() if k in argnames)) or 0
+    if mismatches : print "\nERROR: results not identical in", ', '.join(mismatches)
+    sys.exit(1 if failures or mismatches else 0)
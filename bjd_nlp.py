@@ -1,58 +1,446 @@
-
+import array
 import collections
-import matplotlib.pyplot as plt
-import nltk
-import numpy as np
+import cPickle
+import fractions
+import functools
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import random
 import re
+import sys
+import types
+
+import instrumentation
+
+# matplotlib, nltk, numpy and scipy take up to seconds to import, so they are
+# only imported by the functions using them, when first called
+
+
+# all non-ascii byte values, for deleting from byte strings with str.translate
+NON_ASCII_BYTES = ''.join(chr(i) for i in xrange(128, 256))
+
+URL_PATTERN = re.compile(r'((http|ftp|https):\/\/)?[\w\-_]+(\.[\w\-_]+)+([\w\-\.,@?^=%&amp;:/~\+#]*[\w\-\@?^=%&amp;/~\+#])?')
 
 
 ################################################################################
 def remove_non_ascii(s) :
     """Removes all non-ascii characters from input string.
     """
-    return "".join(c for c in s if ord(c)<128)
+    if isinstance(s, unicode) :
+        return s.encode('ascii', 'ignore').decode('ascii')
+    return s.translate(None, NON_ASCII_BYTES)
 
 
 ################################################################################
 def remove_URLs(s) :
     """Removes all URLs from input string.
     """
-    pattern = r'((http|ftp|https):\/\/)?[\w\-_]+(\.[\w\-_]+)+([\w\-\.,@?^=%&amp;:/~\+#]*[\w\-\@?^=%&amp;/~\+#])?'
-    return re.sub(pattern, ' ', s)
+    return URL_PATTERN.sub(' ', s)
+
+
+################################################################################
+class TextCleaner(object) :
+    """Removes digits, non-standard white space, URLs, and non-Ascii from raw text,
+    same as clean_text, but with all patterns compiled once up front.
+    Digit removal and white space standardization are merged into one pass.
+    """
+
+    def __init__(self) :
+        # replacing digits by ' ' then squeezing white space == squeezing both
+        self.digits_and_space = re.compile(r'[\d\s]+')
+        self.urls = URL_PATTERN
+
+    def clean(self, text) :
+        """Cleans a single text (string).
+        """
+        instrumentation.count('clean.bytes', len(text))
+        text = text.lower()                            # remove capitalization
+        text = self.digits_and_space.sub(' ', text)    # remove digits, standardize white space
+        text = self.urls.sub(' ', text)                # remove all urls
+        return remove_non_ascii(text)                  # remove all non-ascii characters
+
+    def clean_many(self, texts) :
+        """Lazily cleans each text in an iterable of texts.
+        """
+        for text in texts :
+            yield self.clean(text)
+
+
+_text_cleaner = TextCleaner()
 
 
 ################################################################################
 def clean_text(text) :
     """Removes digits, non-standard white space, URLs, and non-Ascii from raw text.
     """
-    text = text.lower()              # remove capitalization
-    text = re.sub('\d', ' ', text)   # remove digits
-    text = re.sub('\s+', ' ', text)  # standardize white space
-    text = remove_URLs(text)         # remove all urls
-    text = remove_non_ascii(text)    # remove all non-ascii characters
-    return text
+    return _text_cleaner.clean(text)
+
+
+# words of texts to be shingled for near-duplicate detection
+SHINGLE_WORD = re.compile(r'\w+')
+# shingles hashed together at once, to bound memory of MinHash's hash matrix
+MINHASH_BLOCK = 1 << 14
+
+
+################################################################################
+class MinHasher(object) :
+    """Computes MinHash signatures of texts over their word shingles, whose
+    share of equal values estimates the Jaccard similarity of two texts' shingles.
+    Each of num_perm hash functions is a random multiply-shift hash, applied to
+    all shingles of a batch of texts at once with numpy.
+    """
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=0) :
+        """@param num_perm: number of hash functions, i.e. length of signatures
+        @type num_perm: int
+        @param shingle_size: number of consecutive words per shingle
+        @type shingle_size: int
+        @param seed: seed for the random hash functions; only signatures made
+            with the same num_perm, shingle_size and seed can be compared
+        @type seed: int
+        """
+        import numpy as np
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rand = np.random.RandomState(seed)
+        def random_uint64(size) :
+            high = rand.randint(0, 1 << 32, size).astype(np.uint64)
+            low = rand.randint(0, 1 << 32, size).astype(np.uint64)
+            return (high << np.uint64(32)) | low
+        # odd multipliers, as multiply-shift hashing needs
+        self.a = (random_uint64(num_perm) | np.uint64(1))[:, np.newaxis]
+        self.b = random_uint64(num_perm)[:, np.newaxis]
+        self.mult = random_uint64(1)[0] | np.uint64(1)
+
+    def _shingle_batch(self, texts) :
+        """Gets 64-bit hashes of the word shingles of texts (lowercased), or of
+        all its words for texts with fewer than shingle_size, as one array in
+        order of texts, possibly repeated within a text; which text each is of;
+        and the number of distinct shingles of each text. Words are hashed with
+        md5, not hash(), so hashes are the same in every process, whatever its
+        hash seed or word size, and each distinct word of the batch only once.
+        """
+        import numpy as np
+        words = [SHINGLE_WORD.findall(text.lower()) for text in texts]
+        lengths = np.array([len(ws) for ws in words], dtype=np.int64)
+        vocab = {}
+        ids = np.array([vocab.setdefault(word, len(vocab)) for ws in words for word in ws], dtype=np.int64)
+        # \w without re.UNICODE only matches ascii, so words encode as is
+        word_hashes = np.frombuffer(''.join(hashlib.md5(str(word)).digest()[:8]
+                                            for word in sorted(vocab, key=vocab.get)), dtype='<u8')
+
+        # shingles starting at every word of all texts at once, padded so
+        # that the last shingles of every text span into the next or padding
+        k = self.shingle_size
+        n = len(ids)
+        ids = np.concatenate([word_hashes[ids].astype(np.uint64), np.zeros(k - 1, dtype=np.uint64)])
+        text_of = np.concatenate([np.repeat(np.arange(len(texts)), lengths), -np.ones(k - 1, dtype=np.int64)])
+        hashes = ids[:n].copy()
+        for j in xrange(1, k) :
+            hashes *= self.mult
+            hashes += ids[j:j + n]
+        keep = text_of[:n] == text_of[k - 1:]
+        # texts shorter than a shingle are one shingle of all their words
+        starts = np.cumsum(lengths) - lengths
+        for i in np.flatnonzero((lengths > 0) & (lengths < k)) :
+            h = ids[starts[i]:starts[i] + 1].copy()
+            for j in xrange(1, lengths[i]) :
+                h *= self.mult
+                h += ids[starts[i] + j:starts[i] + j + 1]
+            hashes[starts[i]] = h[0]
+            keep[starts[i]] = True
+        hashes, text_of = hashes[keep], text_of[:n][keep]
+
+        # count distinct (text, shingle) pairs by packing the text into the
+        # low bits of the hash, which only ignores the hash's lowest bits
+        bits = np.uint64(max(len(texts), 1).bit_length())
+        pairs = np.unique(((hashes >> bits) << bits) | text_of.astype(np.uint64))
+        mask = np.uint64((1 << int(bits)) - 1)
+        n_shingles = np.bincount((pairs & mask).astype(np.int64), minlength=len(texts))
+        return hashes, text_of, n_shingles
+
+    def shingles(self, text) :
+        """Gets 64-bit hashes of the distinct word shingles of a text (lowercased),
+        or of all its words if there are fewer than shingle_size.
+        """
+        import numpy as np
+        return np.unique(self._shingle_batch([text])[0])
+
+    def signatures(self, texts) :
+        """Gets MinHash signatures of texts, one row per text, as a numpy uint32
+        array. Texts without any words get no signature: their row is all
+        0xffffffff, and None is given for them in the list of shingle counts.
+        return: (signatures, number of distinct shingles of each text, or None)
+        """
+        import numpy as np
+        texts = list(texts)
+        hashes, text_of, n_shingles = self._shingle_batch(texts)
+        counts = [int(c) or None for c in n_shingles]
+        # columns of each text's shingles, repeats included, which can't
+        # change a minimum
+        n_columns = np.bincount(text_of, minlength=len(texts))
+        starts = np.cumsum(n_columns) - n_columns
+        sigs = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        sigs.fill(0xffffffff)
+        rows = np.flatnonzero(n_columns)
+        # hash shingles of many texts together, min over each text's own columns
+        start = 0
+        while start < len(rows) :
+            end = start
+            n_block = 0
+            while end < len(rows) and (end == start or n_block + n_columns[rows[end]] <= MINHASH_BLOCK) :
+                n_block += n_columns[rows[end]]
+                end += 1
+            block = rows[start:end]
+            first = starts[block[0]]
+            block_hashes = hashes[first:first + n_block]
+            block_hashes = (self.a * block_hashes + self.b) >> np.uint64(32)
+            sigs[block] = np.minimum.reduceat(block_hashes, starts[block] - first, axis=1).T
+            start = end
+        return sigs, counts
+
+    def signature(self, text) :
+        """Gets MinHash signature of a single text, or None if it has no words.
+        """
+        sigs, counts = self.signatures([text])
+        return sigs[0] if counts[0] is not None else None
+
+
+################################################################################
+def get_lsh_params(threshold, num_perm, recall=0.95) :
+    """Picks numbers of LSH bands and rows per band, with bands * rows at most
+    num_perm: the most rows per band (so the fewest needless comparisons of
+    dissimilar texts) for which texts of similarity threshold still share a band,
+    and so are compared, with probability at least recall.
+    return: (bands, rows)
+    """
+    for rows in xrange(num_perm, 0, -1) :
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall : return bands, rows
+    return num_perm, 1
+
+
+################################################################################
+class NearDuplicateIndex(object) :
+    """Finds near-duplicate texts as they're added, by locality-sensitive hashing
+    of their MinHash signatures: signatures are cut into bands, and only texts
+    sharing a whole band with a new text are compared with it, so adding a text
+    takes about constant time rather than time proportional to all texts so far.
+    Texts whose estimated Jaccard similarity to an earlier text is at least
+    threshold are duplicates of it; each keeps the key of its cluster's first text.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=0,
+                 bands=None, rows=None) :
+        """@param threshold: minimum estimated Jaccard similarity of shingles of duplicates
+        @type threshold: float
+        @param bands: number of LSH bands, with rows per band; by default
+            picked for threshold by get_lsh_params. More bands (of fewer rows)
+            miss fewer duplicates at the cost of more comparisons.
+        @type bands: int
+        """
+        self.threshold = threshold
+        self.minhasher = MinHasher(num_perm, shingle_size, seed)
+        if bands is None or rows is None :
+            bands, rows = get_lsh_params(threshold, num_perm)
+        if bands * rows > num_perm : raise ValueError('bands * rows must be at most num_perm')
+        self.bands = bands
+        self.rows = rows
+        self.buckets = [{} for band in xrange(bands)]
+        # signatures of first texts of clusters, by key
+        self.signatures = {}
+        self.n_texts = 0
+        self.n_duplicates = 0
+        self.n_compared = 0
+        self.n_shingles = 0
+        self.n_duplicate_shingles = 0
+
+    def query(self, signature) :
+        """Gets key of the earlier text most similar to a signature, if at least
+        threshold, and that similarity; or (None, 0.0).
+        """
+        import numpy as np
+        best, best_sim = None, 0.0
+        seen = set()
+        for band, buckets in enumerate(self.buckets) :
+            for key in buckets.get(signature[band * self.rows:(band + 1) * self.rows].tostring(), ()) :
+                if key in seen : continue
+                seen.add(key)
+                sim = np.mean(self.signatures[key] == signature)
+                if sim >= self.threshold and sim > best_sim : best, best_sim = key, sim
+        self.n_compared += len(seen)
+        return best, best_sim
+
+    def add(self, key, signature, n_shingles=0) :
+        """Adds a text's signature under key, unless it's a near-duplicate of an
+        earlier text. Texts without a signature (no words) are never duplicates.
+        return: key of the earlier text it duplicates, or None
+        """
+        self.n_texts += 1
+        self.n_shingles += n_shingles
+        if signature is None : return None
+        duplicate_of, sim = self.query(signature)
+        if duplicate_of is not None :
+            self.n_duplicates += 1
+            self.n_duplicate_shingles += n_shingles
+            return duplicate_of
+        self.signatures[key] = signature
+        for band, buckets in enumerate(self.buckets) :
+            buckets.setdefault(signature[band * self.rows:(band + 1) * self.rows].tostring(), []).append(key)
+        return None
+
+    def add_texts(self, keys, texts) :
+        """Adds a batch of texts, computing their signatures all at once.
+        return: list of keys of earlier texts each duplicates, or None
+        """
+        sigs, counts = self.minhasher.signatures(texts)
+        return [self.add(key, sig if count is not None else None, count or 0)
+                for key, sig, count in itertools.izip(keys, sigs, counts)]
+
+    def report(self) :
+        """Summarizes texts seen so far, and how much later work dropping
+        duplicates saves, measured in texts and in (distinct) shingles.
+        """
+        return {'texts': self.n_texts, 'duplicates': self.n_duplicates,
+                'clusters': len(self.signatures), 'comparisons': self.n_compared,
+                'texts_saved': self.n_duplicates / float(max(self.n_texts, 1)),
+                'shingles_saved': self.n_duplicate_shingles / float(max(self.n_shingles, 1))}
+
+
+################################################################################
+def dedup_docs(docs, text_key='article_text', cluster=False, index=None,
+               batchsize=256, **kwargs) :
+    """Lazily drops near-duplicate documents, e.g. syndicated copies of the same
+    wire story in parsed LexisNexis output, before expensive NLP stages like
+    clean_text and tokenize_and_tag. The first copy of each story is kept.
+    @param docs: documents, as dicts (e.g. parsed LexisNexis rows) or strings
+    @type docs: iterable
+    @param text_key: key of the text of dict documents to compare
+    @type text_key: string
+    @param cluster: yield every document instead, with its 'duplicate_of' set to
+        the number (from 0, in input order) of its cluster's first document, or
+        None for first documents; dict documents only
+    @type cluster: boolean
+    @param index: NearDuplicateIndex to use, e.g. to read its report() after,
+        or to dedup against documents seen before; new one by default, made
+        with any other keyword arguments (threshold, num_perm, ...)
+    @type index: NearDuplicateIndex
+    @param batchsize: number of documents whose signatures are computed together
+    @type batchsize: int
+    """
+    if index is None : index = NearDuplicateIndex(**kwargs)
+    docs = iter(docs)
+    batches = iter(lambda: list(itertools.islice(docs, batchsize)), [])
+
+    def check(batch) :
+        if cluster is True and any(isinstance(doc, basestring) for doc in batch) :
+            raise TypeError('dedup_docs with cluster=True needs dict documents, '
+                            'to set their duplicate_of')
+        return batch
+
+    # check the first batch now, and every later one before adding any of it
+    first = check(next(batches, []))
+
+    def dedup() :
+        start = index.n_texts
+        for batch in itertools.chain([first], itertools.imap(check, batches)) :
+            texts = [doc if isinstance(doc, basestring) else doc[text_key] for doc in batch]
+            keys = xrange(start, start + len(batch))
+            start += len(batch)
+            for doc, duplicate_of in itertools.izip(batch, index.add_texts(keys, texts)) :
+                instrumentation.count('dedup.documents')
+                if duplicate_of is not None : instrumentation.count('dedup.duplicates')
+                if cluster is True :
+                    doc['duplicate_of'] = duplicate_of
+                    yield doc
+                elif duplicate_of is None :
+                    yield doc
+    return dedup()
+
+
+################################################################################
+class LRUCache(object) :
+    """Memoizes a function of one argument, keeping at most maxsize of the most
+    recently used results, and counting cache hits and misses.
+    """
+
+    def __init__(self, func, maxsize=100000) :
+        self.func = func
+        self.maxsize = maxsize
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, key) :
+        try :
+            value = self.cache.pop(key)
+            self.hits += 1
+        except KeyError :
+            value = self.func(key)
+            self.misses += 1
+            if len(self.cache) >= self.maxsize : self.cache.popitem(last=False)
+        self.cache[key] = value
+        return value
+
+    def info(self) :
+        """Gets dict of cache hits, misses, current size and maximum size.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache), 'maxsize': self.maxsize}
+
+    def clear(self) :
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+STEMMERS = {'porter': 'PorterStemmer', 'lancaster': 'LancasterStemmer'}
+STEM_CACHE_SIZE = 100000
+
+# memoized stem functions by stemmer name, created on first use
+_stemmers = {}
+
+
+################################################################################
+def get_stemmer(which='porter') :
+    """Gets memoized stem function (an LRUCache) for a stemmer, creating the
+    stemmer only once per process.
+    @param which: Which stemmer to use, either porter or lancaster
+    @type which: string
+    """
+    import nltk
+    which = which.lower()
+    if which not in _stemmers :
+        if which not in STEMMERS :
+            raise NameError("'which' argument must have value of 'porter' or 'lancaster'")
+        stemmer = getattr(nltk, STEMMERS[which])()
+        _stemmers[which] = LRUCache(stemmer.stem, STEM_CACHE_SIZE)
+    return _stemmers[which]
 
 
 ################################################################################
 def stem_words(words, which='porter') :
     """Given a list of words (tokenized), return list of stemmed words
+    Each distinct word is stemmed once, through a cache shared across calls.
     @param which: Which stemmer to use, either porter or lancaster
     @type which: string
     """
-    if which.lower() == 'porter' :
-        stemmer = nltk.PorterStemmer()
-    elif which.lower() == 'lancaster' :
-        stemmer = nltk.LancasterStemmer()
-    else :
-        raise NameError("'which' argument must have value of 'porter' or 'lancaster'")
-    stems = [stemmer.stem(word) for word in words]
-    return stems
+    words = list(words)
+    stem = get_stemmer(which)
+    stems = dict((word, stem(word)) for word in set(words))
+    instrumentation.count('stem.tokens', len(words))
+    instrumentation.count('stem.types', len(stems))
+    return [stems[word] for word in words]
 
 
 ################################################################################
 def tokenize_and_tag(text) :
     """Given text (string), tokenize into sentences and words and tag parts-of-spech.
     """
+    import nltk
     sents = nltk.sent_tokenize(text)    # default sentence tokenizer
     sents = [nltk.wordpunct_tokenize(sent) for sent in sents]    # default word tokenizer
     sents = [nltk.pos_tag(sent) for sent in sents]    # default POS tagger
@@ -60,7 +448,121 @@ def tokenize_and_tag(text) :
 
 
 ################################################################################
-def get_nbest_trigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10, scores=False) :
+def iter_in_pool(func, items, workers=1, chunksize=100, initializer=None) :
+    """Lazily applies func to chunks of items, in a pool of worker processes if
+    workers > 1, yielding individual results in input order. Only 2 chunks per
+    worker are in flight at a time, so items can be an arbitrarily long stream.
+    @param func: function taking a list of items and returning a list of results
+    @param initializer: function called once in each worker process at start;
+        it must not raise, since Python 2's Pool replaces a worker that dies in
+        its initializer forever, hanging instead. Load anything that can fail
+        (e.g. NLTK data) lazily in func instead, whose errors are raised here.
+    """
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+    if workers <= 1 :
+        if initializer is not None : initializer()
+        for chunk in chunks :
+            for result in func(chunk) : yield result
+        return
+    pool = multiprocessing.Pool(workers, initializer=initializer)
+    pending = collections.deque()
+    try :
+        for chunk in chunks :
+            pending.append(pool.apply_async(func, (chunk,)))
+            if len(pending) >= 2 * workers :
+                for result in pending.popleft().get() : yield result
+        while pending :
+            for result in pending.popleft().get() : yield result
+        pool.close()
+    finally :
+        pool.terminate()
+        pool.join()
+
+
+# NLTK's default POS tagger, loaded once per process
+_tagger = None
+
+
+################################################################################
+def get_tagger() :
+    """Gets NLTK's default POS tagger (as used by nltk.pos_tag), loading it only once.
+    """
+    import nltk
+    global _tagger
+    if _tagger is None : _tagger = nltk.tag.PerceptronTagger()
+    return _tagger
+
+
+################################################################################
+def _tokenize_and_tag_texts(texts) :
+    """Tokenizes texts like tokenize_and_tag, then tags all their sentences in a
+    single batch with the cached tagger.
+    """
+    import nltk
+    text_sents = [[nltk.wordpunct_tokenize(sent) for sent in nltk.sent_tokenize(text)]
+                  for text in texts]
+    tagged = iter(get_tagger().tag_sents([sent for sents in text_sents for sent in sents]))
+    return [[next(tagged) for sent in sents] for sents in text_sents]
+
+
+################################################################################
+def tokenize_and_tag_many(texts, workers=1, chunksize=100) :
+    """Given iterable of texts (strings), lazily yields each one tokenized into
+    sentences and words and tagged with parts-of-speech, as by tokenize_and_tag,
+    in input order.
+    @param workers: number of processes to tokenize and tag in parallel
+    @type workers: int
+    @param chunksize: number of texts sent to a worker at a time
+    @type chunksize: int
+    """
+    # the tagger is loaded by _tokenize_and_tag_texts, not a Pool initializer,
+    # so a missing model raises LookupError here instead of hanging the pool
+    for sents in iter_in_pool(_tokenize_and_tag_texts, texts, workers, chunksize) :
+        instrumentation.count('tag.texts')
+        instrumentation.count('tag.tokens', sum(len(sent) for sent in sents))
+        yield sents
+
+
+# frozen sets of stopwords by language, loaded from NLTK on first use
+_stopwords = {}
+
+
+################################################################################
+def get_stopwords(language='english') :
+    """Gets frozen set of stopwords for a language, loading NLTK's list only once.
+    @param language: Name of stopwords list in NLTK's stopwords corpus
+    @type language: string
+    """
+    import nltk
+    if language not in _stopwords :
+        _stopwords[language] = frozenset(nltk.corpus.stopwords.words(language))
+    return _stopwords[language]
+
+
+################################################################################
+def add_stopwords(words, language='english') :
+    """Adds custom stopwords to the cached set for a language.
+    @param words: additional stopwords
+    @type words: list of strings
+    """
+    _stopwords[language] = get_stopwords(language) | frozenset(words)
+
+
+################################################################################
+def get_stop_ngrams(stop_ngs) :
+    """Converts stop ngrams into a frozen set of word tuples, for constant-time
+    lookups of ngrams as NLTK's collocation finders hand them to filters.
+    @param stop_ngs: ngrams to remove from consideration
+    @type stop_ngs: list of space-separated strings, e.g. 'new york', or of tuples
+    """
+    return frozenset(tuple(ng.split(' ')) if isinstance(ng, basestring) else tuple(ng)
+                     for ng in stop_ngs)
+
+
+################################################################################
+def get_nbest_trigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10, scores=False,
+                      language='english') :
     """Gets N best trigrams from a list of words.
     @param measure: ngram association measure to use in scoring
     @type measure: string; 'pmi', 'chi_sq', 'likelihood_ratio', 'student_t', 'raw_freq'
@@ -68,14 +570,19 @@ def get_nbest_trigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10,
     @type min_freq: int; default value of 0, so no frequency filtering
     @param n_best: number of highest-scored ngrams to return
     @param stop_ngs: list of ngrams to remove from consideration
-    @type stop_ngs: list
+    @type stop_ngs: list of space-separated strings or of tuples
     @type n_best: int
     @param scores: return tuples of ngram and scores, or not
     @type scores: boolean
+    @param language: language of stopwords to filter out
+    @type language: string
     """
+    import nltk
     tcf = nltk.collocations.TrigramCollocationFinder.from_words(words)
-    tcf.apply_word_filter(lambda w: len(w) < 3 or w in set(nltk.corpus.stopwords.words('english')))
-    tcf.apply_ngram_filter(lambda w1, w2, w3: ' '.join([w1,w2,w3]) in stop_ngs)
+    stopwords = get_stopwords(language)
+    stop_ngs = get_stop_ngrams(stop_ngs)
+    tcf.apply_word_filter(lambda w: len(w) < 3 or w in stopwords)
+    tcf.apply_ngram_filter(lambda *ngram: ngram in stop_ngs)
     tcf.apply_freq_filter(min_freq)
     if measure == 'pmi' : m = nltk.collocations.TrigramAssocMeasures.pmi
     elif measure == 'chi_sq' : m = nltk.collocations.TrigramAssocMeasures.chi_sq
@@ -90,7 +597,8 @@ def get_nbest_trigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10,
 
 
 ################################################################################
-def get_nbest_bigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10, scores=False) :
+def get_nbest_bigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10, scores=False,
+                      language='english') :
     """Gets N best bigrams from a list of words.
     @param measure: ngram association measure to use in scoring
     @type measure: string; 'pmi', 'chi_sq', 'likelihood_ratio', 'student_t', 'raw_freq'
@@ -98,14 +606,19 @@ def get_nbest_bigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10,
     @type min_freq: int; default value of 0, so no frequency filtering
     @param n_best: number of highest-scored ngrams to return
     @param stop_ngs: list of ngrams to remove from consideration
-    @type stop_ngs: list
+    @type stop_ngs: list of space-separated strings or of tuples
     @type n_best: int
     @param scores: return tuples of ngram and scores, or not
     @type scores: boolean
+    @param language: language of stopwords to filter out
+    @type language: string
     """
+    import nltk
     bcf = nltk.collocations.BigramCollocationFinder.from_words(words)
-    bcf.apply_word_filter(lambda w: len(w) < 3 or w in set(nltk.corpus.stopwords.words('english')))
-    bcf.apply_ngram_filter(lambda w1, w2: ' '.join([w1,w2]) in stop_ngs)
+    stopwords = get_stopwords(language)
+    stop_ngs = get_stop_ngrams(stop_ngs)
+    bcf.apply_word_filter(lambda w: len(w) < 3 or w in stopwords)
+    bcf.apply_ngram_filter(lambda *ngram: ngram in stop_ngs)
     bcf.apply_freq_filter(min_freq)
     if measure == 'pmi' : m = nltk.collocations.BigramAssocMeasures.pmi
     elif measure == 'chi_sq' : m = nltk.collocations.BigramAssocMeasures.chi_sq
@@ -119,28 +632,378 @@ def get_nbest_bigrams(words, measure='pmi', min_freq=0, stop_ngs=[], n_best=10,
         return bcf.score_ngrams(m)[:n_best]
 
 
+# as in nltk.metrics.association, to avoid division by zero
+_SMALL = 1e-20
+
+
+################################################################################
+def _dense_keys(cols, base) :
+    """Combines equal-length columns of integer ids into one array of integer
+    keys that are equal where whole rows are equal, ranking one column at a time
+    so keys never overflow.
+    """
+    import numpy as np
+    keys = cols[0]
+    for col in cols[1:] :
+        keys = np.unique(keys * base + col, return_inverse=True)[1]
+    return keys
+
+
+################################################################################
+def count_ngram_marginals(ids, n, first) :
+    """Counts, for ngrams starting at positions first in an array of word ids,
+    occurrences in the text of every subset of their words, in the same relative
+    positions (e.g. 'w1 _ w3'), as NLTK's collocation finders do.
+    return: dict of {bitmask of word positions: array of counts}
+    """
+    import numpy as np
+    n_all = len(ids)
+    base = ids.max() + 1
+    unigram_counts = np.bincount(ids)
+    marginals = {}
+    for mask in range(1, 1 << n) :
+        positions = [k for k in range(n) if mask >> k & 1]
+        if len(positions) == 1 :
+            marginals[mask] = unigram_counts[ids[first + positions[0]]]
+            continue
+        start = positions[0]
+        n_pos = n_all - (positions[-1] - start)
+        keys = _dense_keys([ids[k - start:k - start + n_pos] for k in positions], base)
+        inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)[1:]
+        marginals[mask] = counts[inverse[first + start]]
+    return marginals
+
+
+################################################################################
+def score_ngram_marginals(measure, n, n_all, marginals) :
+    """Scores ngrams by association measure, vectorized over arrays of counts,
+    using the same formulas as nltk.collocations' AssocMeasures classes.
+    @param measure: ngram association measure to use in scoring
+    @type measure: string; 'pmi', 'chi_sq', 'likelihood_ratio', 'student_t', 'raw_freq'
+    @param n_all: total number of words
+    @param marginals: output of count_ngram_marginals
+    @type marginals: dict of {bitmask of word positions: array of counts}
+    """
+    import numpy as np
+    full = (1 << n) - 1
+    marginals = dict((mask, np.asarray(counts, dtype=np.float64)) for mask, counts in marginals.items())
+    n_all = float(n_all)
+    n_i = marginals[full]
+    unigrams = [marginals[1 << k] for k in range(n)]
+    unigram_product = 1
+    for unigram in unigrams : unigram_product = unigram_product * unigram
+
+    if measure == 'raw_freq' :
+        return n_i / n_all
+    elif measure == 'student_t' :
+        return (n_i - unigram_product / n_all ** (n - 1)) / (n_i + _SMALL) ** 0.5
+    elif measure == 'pmi' :
+        return np.log(n_i * n_all ** (n - 1)) / np.log(2.0) - np.log(unigram_product) / np.log(2.0)
+    elif measure not in ('chi_sq', 'likelihood_ratio') :
+        raise NameError('Valid association measure must be provided!')
+
+    # contingency table, indexed by bitmask of absent words as in NLTK,
+    # with cells derived from subset counts by inclusion-exclusion
+    cont = []
+    for absent in range(full + 1) :
+        present = full ^ absent
+        cell = 0
+        for mask in range(full + 1) :
+            if mask & present != present : continue
+            count = n_all if mask == 0 else marginals[mask]
+            if bin(mask ^ present).count('1') % 2 == 0 : cell = cell + count
+            else : cell = cell - count
+        cont.append(cell)
+
+    if measure == 'chi_sq' and n == 2 :
+        # NLTK's bigram-specific formula, via phi squared
+        a, b, c, d = cont
+        return n_all * ((a * d - b * c) ** 2 / ((a + b) * (a + c) * (b + d) * (c + d)))
+    score = 0
+    for cell, obs in enumerate(cont) :
+        exp = 1
+        for k in range(n) :
+            exp = exp * (n_all - unigrams[k] if cell >> k & 1 else unigrams[k])
+        exp = exp / n_all ** (n - 1)
+        if measure == 'chi_sq' : score = score + (obs - exp) ** 2 / (exp + _SMALL)
+        else : score = score + obs * np.log(obs / (exp + _SMALL) + _SMALL)
+    if measure == 'likelihood_ratio' : score = n * score
+    return score
+
+
+################################################################################
+def select_nbest_ngrams(ngrams, scores, n_best) :
+    """Gets indices of the n_best highest-scored ngrams, ordered by descending
+    score then ngram, as NLTK does, without fully sorting all scores.
+    @param ngrams: function mapping an index to its ngram (tuple of words)
+    @param scores: ngram scores
+    @type scores: numpy array
+    """
+    import numpy as np
+    if n_best < len(scores) :
+        # n_best-th highest score; ties with it are broken by ngram below
+        kth = np.partition(scores, len(scores) - n_best)[len(scores) - n_best]
+        above = np.flatnonzero(scores > kth).tolist()
+        tied = np.flatnonzero(scores == kth).tolist()
+        best = above + heapq.nsmallest(n_best - len(above), tied, key=ngrams)
+    else :
+        best = range(len(scores))
+    return sorted(best, key=lambda i: (-scores[i], ngrams(i)))
+
+
+################################################################################
+def get_nbest_ngrams(words, n=2, measure='pmi', min_freq=0, stop_ngs=[], n_best=10,
+                     scores=False, language='english') :
+    """Gets N best ngrams of any length from a list of words, matching
+    get_nbest_bigrams and get_nbest_trigrams for n=2 and n=3 but counting and
+    scoring all ngrams at once in numpy arrays of integer word ids.
+    @param n: number of words per ngram
+    @type n: int, at least 2
+    @param measure: ngram association measure to use in scoring
+    @type measure: string; 'pmi', 'chi_sq', 'likelihood_ratio', 'student_t', 'raw_freq'
+    @param min_freq: minimum ngram frequency to keep
+    @type min_freq: int; default value of 0, so no frequency filtering
+    @param n_best: number of highest-scored ngrams to return
+    @param stop_ngs: list of ngrams to remove from consideration
+    @type stop_ngs: list of space-separated strings or of tuples
+    @type n_best: int
+    @param scores: return tuples of ngram and scores, or not
+    @type scores: boolean
+    @param language: language of stopwords to filter out
+    @type language: string
+    """
+    import numpy as np
+    if n < 2 : raise ValueError('ngrams must have at least 2 words')
+    vocab = {}
+    ids = np.array([vocab.setdefault(word, len(vocab)) for word in words], dtype=np.int64)
+    instrumentation.count('ngrams.tokens', len(ids))
+    if len(ids) < n : return []
+    id_words = [None] * len(vocab)
+    for word, i in vocab.iteritems() : id_words[i] = word
+
+    # count distinct ngrams, keeping the position of each one's first occurrence
+    n_grams = len(ids) - n + 1
+    keys = _dense_keys([ids[k:k + n_grams] for k in range(n)], len(vocab))
+    first, counts = np.unique(keys, return_index=True, return_counts=True)[1:]
+    grams = np.column_stack([ids[first + k] for k in range(n)])
+
+    # filter out short words and stopwords, stop ngrams, and infrequent ngrams
+    stopwords = get_stopwords(language)
+    bad_ids = np.array([len(w) < 3 or w in stopwords for w in id_words], dtype=bool)
+    keep = ~bad_ids[grams].any(axis=1) & (counts >= min_freq)
+    for ngram in get_stop_ngrams(stop_ngs) :
+        if len(ngram) != n or any(w not in vocab for w in ngram) : continue
+        keep &= ~(grams == [vocab[w] for w in ngram]).all(axis=1)
+    first, grams = first[keep], grams[keep]
+    if len(first) == 0 : return []
+
+    ngram_scores = score_ngram_marginals(measure, n, len(ids), count_ngram_marginals(ids, n, first))
+    ngram = lambda i: tuple(id_words[w] for w in grams[i])
+    best = select_nbest_ngrams(ngram, ngram_scores, n_best)
+    if scores is False :
+        return [ngram(i) for i in best]
+    elif scores is True :
+        return [(ngram(i), float(ngram_scores[i])) for i in best]
+
+
 ################################################################################
-def regex_chunker(sentence, np_only=False) :
+class CollocationCounter(object) :
+    """Accumulates ngram counts from batches of words (e.g. documents) so that
+    N best collocations can be scored at any time without rescanning old text.
+    Counters can be merged, e.g. across processes, and saved to / loaded from disk.
+    Ngrams never span batches.
+    """
+
+    def __init__(self, n=2) :
+        """@param n: number of words per ngram
+        @type n: int, at least 2
+        """
+        if n < 2 : raise ValueError('ngrams must have at least 2 words')
+        self.n = n
+        self.n_all = 0
+        # counts of word tuples by relative offsets within an ngram, for every
+        # subset of ngram positions (e.g. (0, 2) for 'w1 _ w3'), as NLTK's finders keep
+        self.counts = {}
+        for mask in range(1, 1 << n) :
+            self.counts[self._offsets(mask)] = collections.Counter()
+
+    def _positions(self, mask) :
+        return [k for k in range(self.n) if mask >> k & 1]
+
+    def _offsets(self, mask) :
+        positions = self._positions(mask)
+        return tuple(k - positions[0] for k in positions)
+
+    def update(self, words) :
+        """Counts ngrams, and all subsets of their words, in a batch of words.
+        @param words: all words in a text, in order
+        @type words: list of strings
+        """
+        words = list(words)
+        instrumentation.count('ngrams.tokens', len(words))
+        self.n_all += len(words)
+        for offsets, counter in self.counts.iteritems() :
+            n_pos = len(words) - offsets[-1]
+            counter.update(itertools.izip(*[words[o:o + n_pos] for o in offsets]))
+
+    def merge(self, other) :
+        """Adds counts of another CollocationCounter with the same n to this one.
+        """
+        if other.n != self.n : raise ValueError('cannot merge counters with different n')
+        self.n_all += other.n_all
+        for offsets, counter in other.counts.iteritems() :
+            self.counts[offsets].update(counter)
+        return self
+
+    __iadd__ = merge
+
+    def save(self, fileName) :
+        """Saves counts to file.
+        """
+        with open(fileName, 'wb') as f :
+            cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fileName) :
+        """Loads counts saved by CollocationCounter.save.
+        """
+        with open(fileName, 'rb') as f :
+            return cPickle.load(f)
+
+    def nbest(self, measure='pmi', min_freq=0, stop_ngs=[], n_best=10, scores=False,
+              language='english') :
+        """Gets N best ngrams from all words counted so far; arguments as for
+        get_nbest_ngrams, with the same results as it gives for all words at once.
+        """
+        import numpy as np
+        stopwords = get_stopwords(language)
+        stop_ngs = get_stop_ngrams(stop_ngs)
+        full = (1 << self.n) - 1
+        ngrams = [ngram for ngram, count in self.counts[self._offsets(full)].iteritems()
+                  if count >= min_freq and ngram not in stop_ngs
+                  and not any(len(w) < 3 or w in stopwords for w in ngram)]
+        if len(ngrams) == 0 : return []
+
+        marginals = {}
+        for mask in range(1, full + 1) :
+            positions = self._positions(mask)
+            counter = self.counts[self._offsets(mask)]
+            marginals[mask] = np.array([counter[tuple(ngram[k] for k in positions)]
+                                        for ngram in ngrams], dtype=np.int64)
+        ngram_scores = score_ngram_marginals(measure, self.n, self.n_all, marginals)
+        best = select_nbest_ngrams(ngrams.__getitem__, ngram_scores, n_best)
+        if scores is False :
+            return [ngrams[i] for i in best]
+        elif scores is True :
+            return [(ngrams[i], float(ngram_scores[i])) for i in best]
+
+
+CHUNK_GRAMMARS = {
+    'default': r"""
+        NP: {<DT|PP\$>?<JJ>*<NN>} # determiner/possessive, adjectives, and noun
+            {<NN.*>+}             # consecutive (proper) nouns
+        PP: {<IN><NP>}            # preposition + NP
+        VP: {<VB.*><NP|PP>*}      # verb words + NPs or PPs
+        """,
+    'np': r"""
+        NP: {<DT|PP\$>?<JJ>*<NN>} # determiner/possessive, adjectives, and noun
+            {<NN.*>+}             # consecutive (proper) nouns
+        """,
+    }
+
+# compiled chunk parsers by (grammar, loop), created on first use
+_chunkers = {}
+
+
+################################################################################
+def register_chunk_grammar(name, grammar) :
+    """Registers a custom chunk grammar, usable by name in regex_chunker and chunk_many.
+    @param grammar: grammar in the format of nltk.RegexpParser
+    @type grammar: string
+    """
+    CHUNK_GRAMMARS[name] = grammar
+
+
+################################################################################
+def get_chunker(grammar='default', loop=2) :
+    """Gets compiled nltk.RegexpParser for a grammar, compiling it only once.
+    @param grammar: name of a grammar in CHUNK_GRAMMARS, or a grammar itself
+    @type grammar: string
+    """
+    import nltk
+    grammar = CHUNK_GRAMMARS.get(grammar, grammar)
+    if (grammar, loop) not in _chunkers :
+        _chunkers[(grammar, loop)] = nltk.RegexpParser(grammar, loop=loop)
+    return _chunkers[(grammar, loop)]
+
+
+################################################################################
+def regex_chunker(sentence, np_only=False, grammar=None) :
     """Given POS-tagged sentence, returns tree with chunked phrases.
     @param sentence: Tokenized sentence with tagged parts of speech (NLTK)
     @param np_only: look only for NPs (and not PPs or VPs)
     @type np_only: boolean
+    @param grammar: custom grammar (or name of registered grammar) to use instead
+    @type grammar: string
+    """
+    if grammar is None :
+        grammar = 'np' if np_only is True else 'default'
+    return get_chunker(grammar).parse(sentence)
+
+
+################################################################################
+def chunk_spans(tree, label='NP') :
+    """Gets (start, end) token offsets of all chunks with a given label in a
+    chunked sentence, including chunks nested in others (e.g. NPs in PPs).
     """
-    if np_only is False :
-        grammar = r"""
-            NP: {<DT|PP\$>?<JJ>*<NN>} # determiner/possessive, adjectives, and noun
-                {<NN.*>+}             # consecutive (proper) nouns
-            PP: {<IN><NP>}            # preposition + NP
-            VP: {<VB.*><NP|PP>*}      # verb words + NPs or PPs
-            """
-    elif np_only is True :
-        grammar = r"""
-            NP: {<DT|PP\$>?<JJ>*<NN>} # determiner/possessive, adjectives, and noun
-                {<NN.*>+}             # consecutive (proper) nouns
-            """
-    cp = nltk.RegexpParser(grammar, loop=2)
-    tree = cp.parse(sentence)
-    return tree
+    import nltk
+    spans = []
+    def walk(subtree, start) :
+        end = start
+        for child in subtree :
+            if isinstance(child, nltk.Tree) :
+                child_end = walk(child, end)
+                if child.label() == label : spans.append((end, child_end))
+                end = child_end
+            else :
+                end += 1
+        return end
+    walk(tree, 0)
+    return sorted(spans)
+
+
+################################################################################
+def _chunk_sents(grammar, spans, sentences) :
+    """Chunks a batch of POS-tagged sentences; run in worker processes.
+    """
+    chunker = get_chunker(grammar)
+    trees = [chunker.parse(sentence) for sentence in sentences]
+    if spans is True : return [chunk_spans(tree) for tree in trees]
+    return trees
+
+
+################################################################################
+def chunk_many(tagged_sents, workers=1, np_only=False, grammar=None, spans=False,
+               chunksize=500) :
+    """Given iterable of POS-tagged sentences, lazily yields each one chunked
+    as by regex_chunker, in input order.
+    @param workers: number of processes to chunk in parallel
+    @type workers: int
+    @param np_only: look only for NPs (and not PPs or VPs)
+    @type np_only: boolean
+    @param grammar: custom grammar (or name of registered grammar) to use instead
+    @type grammar: string
+    @param spans: yield lists of (start, end) token offsets of NPs instead of trees
+    @type spans: boolean
+    @param chunksize: number of sentences sent to a worker at a time
+    @type chunksize: int
+    """
+    if grammar is None :
+        grammar = 'np' if np_only is True else 'default'
+    # send grammar itself, in case it was registered after workers started
+    grammar = CHUNK_GRAMMARS.get(grammar, grammar)
+    func = functools.partial(_chunk_sents, grammar, spans)
+    return iter_in_pool(func, tagged_sents, workers, chunksize)
 
 
 ################################################################################
@@ -158,19 +1021,258 @@ def bag_of_words(words, bad_words=False) :
 
 
 ################################################################################
-def get_label_features_from_corpus(corpus, feature_detector=bag_of_words) :
+class Vocabulary(object) :
+    """Maps words to consecutive integer feature indices, and back.
+    """
+
+    def __init__(self, words=()) :
+        self.index = {}
+        self.words = []
+        for word in words : self.add(word)
+
+    def add(self, word) :
+        """Gets index of word, adding it to the vocabulary if it's new.
+        """
+        try :
+            return self.index[word]
+        except KeyError :
+            self.index[word] = len(self.words)
+            self.words.append(word)
+            return self.index[word]
+
+    def __getitem__(self, word) :
+        return self.index[word]
+
+    def __contains__(self, word) :
+        return word in self.index
+
+    def __len__(self) :
+        return len(self.words)
+
+
+################################################################################
+def bag_of_words_matrix(docs, vocabulary=None, bad_words=False, grow=True) :
+    """Input iterable of word lists, return sparse matrix of the same features
+    as bag_of_words, one row per doc and one column per word in the vocabulary,
+    built in one pass. Requires scipy.
+    @param docs: all (good) words in each text
+    @type docs: iterable of lists of strings
+    @param vocabulary: vocabulary to index words by, new one by default
+    @type vocabulary: Vocabulary
+    @param bad_words: optional list of bad words to exclude as features
+    @type bad_words: list of strings, or False by default
+    @param grow: add unseen words to vocabulary; if False, they are ignored,
+        e.g. to featurize test docs with a training vocabulary
+    @type grow: boolean
+    return: (scipy.sparse.csr_matrix of booleans, vocabulary)
+    """
+    import numpy as np
+    import scipy.sparse
+    if vocabulary is None : vocabulary = Vocabulary()
+    bad_words = set(bad_words) if bad_words is not False else set()
+    indices = array.array('l')
+    indptr = array.array('l', [0])
+    index = vocabulary.index
+    for words in docs :
+        words = set(words)
+        words.difference_update(bad_words)
+        if grow is True :
+            row = [index[word] if word in index else vocabulary.add(word) for word in words]
+        else :
+            row = [index[word] for word in words if word in index]
+        indices.extend(row)
+        indptr.append(len(indices))
+    indices = np.frombuffer(indices, dtype=np.int_) if len(indices) else np.zeros(0, dtype=np.int_)
+    indptr = np.frombuffer(indptr, dtype=np.int_)
+    data = np.ones(len(indices), dtype=bool)
+    matrix = scipy.sparse.csr_matrix((data, indices, indptr),
+                                     shape=(len(indptr) - 1, len(vocabulary)))
+    matrix.sort_indices()
+    return matrix, vocabulary
+
+
+################################################################################
+def matrix_to_featuresets(matrix, vocabulary, labels=None) :
+    """Lazily converts rows of a bag_of_words_matrix into NLTK-style feature
+    sets {word: True}, or (featureset, label) pairs if labels are given, only
+    when a classifier needs them.
+    """
+    words = vocabulary.words
+    for i in xrange(matrix.shape[0]) :
+        row = matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+        features = dict((words[j], True) for j in row)
+        if labels is None : yield features
+        else : yield features, labels[i]
+
+
+################################################################################
+def get_label_matrix_from_corpus(corpus, bad_words=False, vocabulary=None) :
+    """Create a sparse bag-of-words matrix of all labeled files in an NLTK corpus,
+    in one pass, as a compact alternative to get_label_features_from_corpus.
+    @param corpus: NLTK corpus to use for training
+    @param bad_words: optional list of bad words to exclude as features
+    @type bad_words: list of strings, or False by default
+    return: (scipy.sparse.csr_matrix, list of labels by row, Vocabulary)
+    """
+    labels = []
+    def docs() :
+        for label in corpus.categories() :
+            for fileid in corpus.fileids(categories=[label]) :
+                labels.append(label)
+                yield corpus.words(fileid)
+    matrix, vocabulary = bag_of_words_matrix(docs(), vocabulary, bad_words)
+    return matrix, labels, vocabulary
+
+
+# (corpus, feature_detector, cache_dir) being featurized, set in each worker process
+_corpus_job = None
+
+
+################################################################################
+def _code_key(code) :
+    """Identifies compiled code by its bytecode, names and constants, including
+    the code of any functions (e.g. lambdas) defined in it.
+    """
+    parts = [code.co_code, repr(code.co_names), repr(code.co_varnames)]
+    for const in code.co_consts :
+        parts.append(_code_key(const) if isinstance(const, types.CodeType) else repr(const))
+    return '\0'.join(parts)
+
+
+################################################################################
+def _feature_detector_key(feature_detector, seen=()) :
+    """Identifies a feature detector by name and a hash of its code, defaults
+    and closure values, and by bound arguments if it's a functools.partial, so
+    that cached featuresets are never mixed up between them, e.g. between two
+    lambdas, or two closures made by the same factory function.
+    """
+    if isinstance(feature_detector, functools.partial) :
+        return '%s(%s, %s)' % (_feature_detector_key(feature_detector.func, seen),
+                               ', '.join(_value_key(arg, seen) for arg in feature_detector.args),
+                               ', '.join('%s=%s' % (k, _value_key(v, seen)) for k, v
+                                         in sorted((feature_detector.keywords or {}).items())))
+    # timed wrappers (see instrumentation) all share the same code
+    feature_detector = getattr(feature_detector, '__wrapped__', feature_detector)
+    key = '%s.%s' % (getattr(feature_detector, '__module__', None),
+                     getattr(feature_detector, '__name__', repr(feature_detector)))
+    # recursive closures refer to themselves
+    if not isinstance(feature_detector, types.FunctionType) or id(feature_detector) in seen :
+        return key
+    seen += (id(feature_detector),)
+    parts = [_code_key(feature_detector.__code__)]
+    parts.extend(_value_key(default, seen) for default in feature_detector.__defaults__ or ())
+    for cell in feature_detector.__closure__ or () :
+        try :
+            parts.append(_value_key(cell.cell_contents, seen))
+        except ValueError :
+            parts.append('<empty>')
+    return '%s:%s' % (key, hashlib.sha1('\0'.join(parts)).hexdigest())
+
+
+################################################################################
+def _value_key(value, seen=()) :
+    """Identifies an argument or closure value of a feature detector.
+    """
+    if callable(value) and not isinstance(value, type) : return _feature_detector_key(value, seen)
+    return repr(value)
+
+
+################################################################################
+def _featureset_cache_file(corpus, fileid, feature_detector, cache_dir) :
+    """Gets name of the cache file of a fileid's featureset, keyed by corpus path,
+    fileid, feature detector and, for plain files, their size and modified time.
+    """
+    key = [str(corpus.root), fileid, _feature_detector_key(feature_detector)]
+    path = getattr(corpus.abspath(fileid), 'path', None)
+    if path is not None and os.path.isfile(path) :
+        stat = os.stat(path)
+        key.extend([str(stat.st_size), repr(stat.st_mtime)])
+    return os.path.join(cache_dir, hashlib.sha1('\0'.join(key)).hexdigest() + '.pickle')
+
+
+################################################################################
+def _init_corpus_job(corpus, feature_detector, cache_dir) :
+    global _corpus_job
+    _corpus_job = (corpus, feature_detector, cache_dir)
+
+
+################################################################################
+def _featurize_fileids(fileids) :
+    """Featurizes a batch of fileids of the current corpus job, each from its own
+    words, reading and writing cached featuresets if there's a cache dir.
+    """
+    corpus, feature_detector, cache_dir = _corpus_job
+    featuresets = []
+    for fileid in fileids :
+        if cache_dir is None :
+            featuresets.append(feature_detector(corpus.words(fileid)))
+            continue
+        cacheFileName = _featureset_cache_file(corpus, fileid, feature_detector, cache_dir)
+        try :
+            with open(cacheFileName, 'rb') as f :
+                featuresets.append(cPickle.load(f))
+            continue
+        except (IOError, EOFError, cPickle.UnpicklingError) :
+            pass
+        features = feature_detector(corpus.words(fileid))
+        # write to temporary file first, so concurrent readers never see half of it
+        tmpFileName = '%s.%d.tmp' % (cacheFileName, os.getpid())
+        with open(tmpFileName, 'wb') as f :
+            cPickle.dump(features, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmpFileName, cacheFileName)
+        featuresets.append(features)
+    return featuresets
+
+
+################################################################################
+def iter_label_features_from_corpus(corpus, feature_detector=bag_of_words, workers=1,
+                                    cache_dir=None, chunksize=10) :
+    """Lazily yields (label, featureset) pairs for each labeled file in an NLTK
+    corpus, in corpus order, each featureset extracted from that file's words.
+    @param corpus: NLTK corpus to use for training
+    @param feature_detector: extract features from text, returned in dictionary form
+    @type feature_detector: function
+    @param workers: number of processes to featurize files in parallel; corpus and
+        feature_detector are inherited by (forked) workers, not pickled
+    @type workers: int
+    @param cache_dir: directory in which to cache featuresets, reused by later
+        calls for the same corpus, fileid and feature detector (name, code,
+        defaults and closure values, but not globals it reads); none by default
+    @type cache_dir: string
+    @param chunksize: number of files sent to a worker at a time
+    @type chunksize: int
+    """
+    if cache_dir is not None and not os.path.isdir(cache_dir) :
+        os.makedirs(cache_dir)
+    labels = []
+    def fileids() :
+        for label in corpus.categories() :
+            for fileid in corpus.fileids(categories=[label]) :
+                labels.append(label)
+                yield fileid
+    initializer = functools.partial(_init_corpus_job, corpus, feature_detector, cache_dir)
+    for i, features in enumerate(iter_in_pool(_featurize_fileids, fileids(), workers,
+                                              chunksize, initializer)) :
+        yield labels[i], features
+
+
+################################################################################
+def get_label_features_from_corpus(corpus, feature_detector=bag_of_words, workers=1,
+                                   cache_dir=None) :
     """Create a list of labeled feature sets from an NLTK corpus to train a classifier.
     @param corpus: NLTK corpus to use for training
     @param feature_detector: extract features from text, returned in dictionary form
     @type feature_detector: function
+    @param workers: number of processes to featurize files in parallel
+    @type workers: int
+    @param cache_dir: directory in which to cache featuresets; none by default
+    @type cache_dir: string
     return: dictionary of the form {label: [featureset]}
     """
     label_features = collections.defaultdict(list)
-    for label in corpus.categories() :
-        for fileid in corpus.fileids(categories=[label]) :
-            print fileid
-            features = feature_detector(corpus.words())
-            label_features[label].append(features)
+    for label, features in iter_label_features_from_corpus(corpus, feature_detector,
+                                                           workers, cache_dir) :
+        label_features[label].append(features)
     return label_features
 
 
@@ -188,17 +1290,170 @@ def split_label_features(l_features, split=0.75) :
 
 
 ################################################################################
-def plot_freq_dist(fd, ylim=20, title=False) :
+def _iter_labeled(label_features) :
+    """Iterates over (label, featureset) pairs from either a stream of them, as
+    yielded by iter_label_features_from_corpus, or a dict {label: [featureset]}.
+    """
+    if hasattr(label_features, 'iteritems') :
+        return ((label, features) for label, features in label_features.iteritems()
+                for features in features)
+    return iter(label_features)
+
+
+################################################################################
+def _seeded_hash(seed, *keys) :
+    """Deterministic (unlike hash) 64-bit integer hash of a seed and keys.
+    """
+    key = '\0'.join(repr(key) for key in (seed,) + keys)
+    return int(hashlib.sha1(key).hexdigest()[:16], 16)
+
+
+################################################################################
+def iter_label_feature_slots(label_features, n_slots, seed=0, stratify=True) :
+    """Lazily assigns each labeled featureset in a stream to one of n_slots slots,
+    reproducibly for a given seed, yielding (slot, (featureset, label)) pairs.
+    If stratify is True, each label's featuresets are dealt out in consecutive
+    blocks of n_slots, every block in its own seeded random order, so each slot
+    gets an equal share (+/- 1) of every label, holding only one block order per
+    label in memory. Assignments depend only on the order of featuresets within
+    each label, not on how labels are interleaved. Otherwise, slots are picked by hashing the seed and position
+    in the stream, uniformly at random.
+    @param label_features: stream of (label, featureset) pairs, or dictionary of
+        the form {label: [featureset]}
+    @param n_slots: number of slots (e.g. folds)
+    @type n_slots: int
+    @param seed: seed for the random assignment
+    @type seed: hashable
+    @param stratify: balance every label across slots
+    @type stratify: boolean
+    """
+    # per label: random generator, current block's order, position in the block
+    blocks = {}
+    for i, (label, features) in enumerate(_iter_labeled(label_features)) :
+        if stratify is True :
+            if label not in blocks :
+                blocks[label] = [random.Random(_seeded_hash(seed, label)), [], n_slots]
+            block = blocks[label]
+            if block[2] == n_slots :
+                block[1] = range(n_slots)
+                block[0].shuffle(block[1])
+                block[2] = 0
+            slot = block[1][block[2]]
+            block[2] += 1
+        else :
+            slot = _seeded_hash(seed, i) % n_slots
+        yield slot, (features, label)
+
+
+################################################################################
+def iter_split_label_features(label_features, split=0.75, seed=0, stratify=True) :
+    """Lazily splits a stream of labeled featuresets into shuffled training and
+    testing instances, yielding (is_train, (featureset, label)) pairs, without
+    holding either set in memory. Unlike split_label_features, the split is a
+    reproducible random one, rather than the first part of every label.
+    @param label_features: stream of (label, featureset) pairs, or dictionary of
+        the form {label: [featureset]}
+    @param split: fraction of instances to use for training, rounded to a
+        fraction with denominator at most 100 if stratify is True
+    @type split: float
+    @param seed: seed for the random split
+    @type seed: hashable
+    @param stratify: keep the split fraction of every label for training
+    @type stratify: boolean
+    """
+    if stratify is True :
+        fraction = fractions.Fraction(split).limit_denominator(100)
+        n_slots, n_train = fraction.denominator, fraction.numerator
+    else :
+        n_slots = 2 ** 32
+        n_train = int(split * n_slots)
+    for slot, instance in iter_label_feature_slots(label_features, n_slots, seed, stratify) :
+        yield slot < n_train, instance
+
+
+################################################################################
+def kfold_label_features(label_features, k=5, seed=0, stratify=True) :
+    """Lazily yields k (train, test) splits of labeled featuresets for k-fold
+    cross-validation, each fold in turn being the test set. Only the test fold
+    is held in memory, as a list of (featureset, label); train is a generator
+    that streams all the other folds.
+    @param label_features: function returning a new stream of (label, featureset)
+        pairs each time it's called, e.g. a functools.partial of
+        iter_label_features_from_corpus, or dictionary of the form {label: [featureset]};
+        not a one-shot stream (e.g. a generator), as every fold reads it twice
+    @param k: number of folds
+    @type k: int
+    @param seed: seed for the random assignment to folds
+    @type seed: hashable
+    @param stratify: balance every label across folds
+    @type stratify: boolean
+    """
+    if callable(label_features) :
+        stream = label_features
+    elif iter(label_features) is label_features :
+        raise TypeError('label_features must be a function returning a new stream each '
+                        'time it is called, or a dict, not a one-shot stream')
+    else :
+        stream = lambda: label_features
+    def train(fold) :
+        for slot, instance in iter_label_feature_slots(stream(), k, seed, stratify) :
+            if slot != fold : yield instance
+    # a generator of generators, so that bad label_features fail on the call
+    def folds() :
+        for fold in xrange(k) :
+            test = [instance for slot, instance
+                    in iter_label_feature_slots(stream(), k, seed, stratify) if slot == fold]
+            yield train(fold), test
+    return folds()
+
+
+################################################################################
+def _new_figure(fileName, **kwargs) :
+    """Creates a matplotlib figure: a pyplot one to show if fileName is None,
+    else one drawn with the Agg backend, off pyplot, so no display is needed and
+    the figure is freed once saved, rather than kept open by pyplot.
+    """
+    if fileName is None :
+        import matplotlib.pyplot as plt
+        return plt.figure(**kwargs)
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    kwargs.pop('num', None)
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+################################################################################
+def _show_figure(fig, fileName, format=None, dpi=None) :
+    """Shows a figure made by _new_figure, closing it once the window is
+    closed, or saves it to fileName.
+    """
+    if fileName is None :
+        import matplotlib.pyplot as plt
+        plt.show()
+        plt.close(fig)
+    else :
+        fig.savefig(fileName, format=format, dpi=dpi)
+
+
+################################################################################
+def plot_freq_dist(fd, ylim=20, title=False, fileName=None, format=None) :
     """Plots NLTK FreqDist in slightly nicer format
     @param fd: Frequency distribution (NLTK)
     @param title: Name of title to add to freq dist
     @type title: string, or boolean False by default
     @param ylim: Number of entries on y-axis
     @type ylim: int
+    @param fileName: Render headless to this file or file-like buffer instead of showing plot
+    @type fileName: string or file
+    @param format: Image format, e.g. 'png' or 'pdf'; by default fileName's extension
+    @type format: string
     """
-    fig = plt.figure("fd", figsize=(6,12), dpi=300, facecolor='white', edgecolor='white')
+    fig = _new_figure(fileName, num="fd", figsize=(6,12), dpi=300, facecolor='white',
+                      edgecolor='white')
     ax = fig.add_subplot(1,1,1)
-    plt.subplots_adjust(left=0.25, right=0.9, top=0.9, bottom=0.1)
+    fig.subplots_adjust(left=0.25, right=0.9, top=0.9, bottom=0.1)
     if title is not False : ax.set_title(title)
     plot = ax.plot([fd[key] for key in fd.keys()], range(0, len(fd.keys())),
     linewidth=10, color='red')
@@ -212,13 +1467,13 @@ def plot_freq_dist(fd, ylim=20, title=False) :
     ax.set_ylim(0,ylim)
     ax.set_xlim(0, fd[fd.keys()[0]]+1)
     ax.set_xlabel('Number of Articles with Mention')
-    plt.gca().invert_yaxis()
-    plt.show()
+    ax.invert_yaxis()
+    _show_figure(fig, fileName, format)
 
 
 ################################################################################
 def plot_barh_chart(fd, ylim=20, title=False, xlab='Default xlab',
-                    n_docs=0, save=False) :
+                    n_docs=0, save=False, fileName=None, format=None) :
     """Plots word frequency distribution (NLTK) as horizontal bar chart.
     @param fd: Frequency distribution (NLTK)
     @param title: Name of title to add to bar chart
@@ -227,12 +1482,19 @@ def plot_barh_chart(fd, ylim=20, title=False, xlab='Default xlab',
     @type ylim: integer
     @param n_docs: Plot bar lengths as fraction of total documents
     @type n_docs: integer
-    @param save: Save plot instead of showing it.
+    @param save: Save plot as plot_barh_chart.pdf instead of showing it.
     @type save: boolean False by default
+    @param fileName: Render headless to this file or file-like buffer instead of showing plot
+    @type fileName: string or file
+    @param format: Image format, e.g. 'png' or 'pdf'; by default fileName's extension
+    @type format: string
     """
-    fig = plt.figure("fd", figsize=(10,6), dpi=150, facecolor='white', edgecolor='white')
+    import numpy as np
+    if save is True and fileName is None : fileName = 'plot_barh_chart.pdf'
+    fig = _new_figure(fileName, num="fd", figsize=(10,6), dpi=150, facecolor='white',
+                      edgecolor='white')
     ax = fig.add_subplot(1,1,1)
-    plt.subplots_adjust(left=0.25, right=0.9, top=0.9, bottom=0.1)
+    fig.subplots_adjust(left=0.25, right=0.9, top=0.9, bottom=0.1)
     if title is not False : ax.set_title(title)
     ax.set_xlabel(xlab)
     pos = np.arange(ylim)+0.5
@@ -250,14 +1512,11 @@ def plot_barh_chart(fd, ylim=20, title=False, xlab='Default xlab',
     for spine in ['left', 'right', 'top'] :
         ax.spines[spine].set_visible(False)
     ax.set_ylim(-0.5, ylim)
-    plt.gca().invert_yaxis()
-    if save is False :
-        plt.show()
-    elif save is True :
-        plt.savefig('plot_barh_chart.pdf', dpi=300)
-
-
-
-
-
+    ax.invert_yaxis()
+    _show_figure(fig, fileName, format, dpi=300 if save is True else None)
 
+# helpers called once per word, text, document or sentence, whose timing
+# would cost about as much as they do themselves
+instrumentation.instrument_module(sys.modules[__name__], exclude=[
+    'remove_non_ascii', 'TextCleaner.clean', 'MinHasher.shingles', 'NearDuplicateIndex.add',
+    'NearDuplicateIndex.query', 'bag_of_words', 'chunk_spans', 'Vocabulary.add'])
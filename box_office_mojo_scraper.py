@@ -1,37 +1,460 @@
 import bs4
+import collections
 import csv
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing.pool
+import os
 import re
 import requests
+import sys
+import threading
+import time
 
+try :
+	import lxml.etree
+except ImportError :
+	lxml = None
+
+import instrumentation
+
+
+logger = logging.getLogger(__name__)
 
 USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_2) AppleWebKit/537.11 (KHTML, like Gecko) Chrome/23.0.1271.95 Safari/537.11'
 BASE_URL = 'http://www.boxofficemojo.com/movies'
+# responses worth retrying, after a pause: rate limited or server trouble
+RETRY_STATUSES = set([429, 500, 502, 503, 504])
+
+def get_film_url(film_id, base_url=BASE_URL) :
+	return base_url + '/?page=weekly&id=' + film_id + '.htm'
+
+# chart cell clean up, in one pass: chart links' hint, dashes, and number formatting
+CELL_CLEANUP = re.compile(u' \\(click to view chart\\)|\x96|[$%,]')
+CELL_REPLACEMENTS = {u'\x96': u'_'}
+INT_CELL = re.compile(r'^[-+]?\d+$')
+FLOAT_CELL = re.compile(r'^[-+]?\d*\.\d+$')
+DATE_RANGE_CELL = re.compile(r'^([A-Z][a-z]+\.? )(\d+)_([A-Z][a-z]+\.? )?(\d+)$')
 
-def get_film_weekly_box_office(film_id) :
-
-	url = BASE_URL + '/?page=weekly&id=' + film_id + '.htm'
-	response = requests.get(url, headers={'User-agent':USER_AGENT})
-	print 'URL:', response.url
-
-	soup = bs4.BeautifulSoup(response.text)
-	body = soup.find('body')
-	tables = body.find_all('table', class_='chart-wide')
-	for table in tables :
-		trs = table.find_all('tr')
-		for tr in trs :
-			tds = tr.find_all('td')
-			row = []
-			for td in tds :
-				text = ' '.join(td.find_all(text=True))
-				text = re.sub(' \(click to view chart\)', '', text)
-				text = re.sub('\x96', '_', text)
-				text = re.sub('\$|%|,', '', text)
-				if re.search(' / ', text) is not None :
-					text = re.split(' / ', text)
-					row.extend(text)
-					continue
-				row.append(text)
+def _clean_cell(match) :
+	return CELL_REPLACEMENTS.get(match.group(), u'')
+
+def _iter_chart_cell_texts(html) :
+	"""Yields lists of raw text of the cells of each row of the chart tables of a
+	page, parsing only those tables: with lxml if installed, else BeautifulSoup.
+	Text in HTML comments is ignored, and cells are always unicode.
+	"""
+	if lxml is not None :
+		# lxml refuses unicode with an encoding declaration (e.g. <?xml ... ?>),
+		# so unicode is parsed as utf-8, overriding any declared encoding
+		if isinstance(html, unicode) :
+			doc = lxml.etree.fromstring(html.encode('utf-8'), lxml.etree.HTMLParser(encoding='utf-8'))
+		else :
+			doc = lxml.etree.fromstring(html, lxml.etree.HTMLParser())
+		if doc is None : return
+		for table in doc.iter('table') :
+			if 'chart-wide' not in (table.get('class') or '').split() : continue
+			for tr in table.iter('tr') :
+				yield [u' '.join(td.itertext()) for td in tr.iter('td')]
+	else :
+		# the strainer sees the whole class attribute, e.g. 'chart-wide foo'
+		is_chart = lambda c : c is not None and 'chart-wide' in c.split()
+		strainer = bs4.SoupStrainer('table', class_=is_chart)
+		soup = bs4.BeautifulSoup(html, 'html.parser', parse_only=strainer)
+		for table in soup.find_all('table', class_='chart-wide') :
+			for tr in table.find_all('tr') :
+				yield [u' '.join(text for text in td.find_all(text=True)
+					if not isinstance(text, bs4.Comment)) for td in tr.find_all('td')]
+
+def parse_film_weekly_box_office(html, typed=False) :
+	"""Parses rows of the weekly box office chart tables of a film's page.
+	Cells are cleaned of chart link hints, dollar signs, percent signs and commas,
+	with dashes replaced by underscores, and cells like 'theaters / change' split.
+	If typed, cells are also converted as by type_weekly_box_office_row.
+	"""
+	rows = []
+	for texts in _iter_chart_cell_texts(html) :
+		row = []
+		for text in texts :
+			text = CELL_CLEANUP.sub(_clean_cell, text)
+			if ' / ' in text :
+				row.extend(text.split(' / '))
+				continue
+			row.append(text)
+		rows.append(type_weekly_box_office_row(row) if typed is True else row)
+	return rows
+
+def type_weekly_box_office_row(row) :
+	"""Converts cleaned cells of a chart row to their types: integers and decimals
+	(e.g. gross, theaters, % change) to int and float, and date ranges like
+	'Mar 29_Apr 4' or 'Mar 1_7' to start and end dates like 'Mar 1', 'Mar 7'.
+	Other cells (e.g. headers) are left as strings, with '-' and 'n/c' as None.
+	"""
+	typed = []
+	for text in row :
+		text = text.strip()
+		if INT_CELL.match(text) is not None :
+			typed.append(int(text))
+		elif FLOAT_CELL.match(text) is not None :
+			typed.append(float(text))
+		elif text in ('-', 'n/c', '') :
+			typed.append(None)
+		else :
+			match = DATE_RANGE_CELL.match(text)
+			if match is None :
+				typed.append(text)
+				continue
+			month, day, end_month, end_day = match.groups()
+			typed.extend([month + day, (end_month or month) + end_day])
+	return typed
+
+def get_film_weekly_box_office(film_id, f_csv, fetcher=None, base_url=BASE_URL) :
+	"""Fetches a film's weekly box office page and writes its chart rows to f_csv.
+	Pass a fetcher to reuse its connections, rate limit and cache across calls;
+	one made here is closed when done.
+	"""
+	own_fetcher = fetcher is None
+	if own_fetcher : fetcher = Fetcher()
+	try :
+		response = fetcher.get(get_film_url(film_id, base_url))
+		logger.info('URL: %s', response.url)
+		for row in parse_film_weekly_box_office(response.text) :
 			f_csv.writerow(row)
+	finally :
+		if own_fetcher : fetcher.close()
+
+
+class TokenBucket(object) :
+	"""Thread-safe token bucket rate limiter: allows rate requests per second on
+	average, in bursts of up to capacity requests.
+	"""
+
+	def __init__(self, rate, capacity=1) :
+		self.rate = float(rate)
+		self.capacity = capacity
+		self.tokens = float(capacity)
+		self.last = time.time()
+		self.lock = threading.Lock()
+
+	def acquire(self) :
+		"""Blocks until a token is available, then takes it.
+		"""
+		while True :
+			with self.lock :
+				now = time.time()
+				self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+				self.last = now
+				if self.tokens >= 1 :
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+
+class CacheMiss(requests.RequestException) :
+	"""Raised in offline mode for a URL that isn't in the cache.
+	"""
+
+
+class ResponseCache(object) :
+	"""On-disk cache of responses by URL. Page bodies are stored once per distinct
+	content, under their sha1, and entries (JSON files under the sha1 of the URL)
+	point to them along with the validators needed for conditional requests.
+	"""
+
+	def __init__(self, cache_dir, ttl=86400, max_bytes=None, max_age=None, offline=False) :
+		"""@param cache_dir: directory to keep cached responses in
+		@type cache_dir: string
+		@param ttl: seconds after fetching (or revalidating) a page that it's used
+			without asking the server; after that, it's revalidated with a conditional request
+		@type ttl: float
+		@param max_bytes: maximum total size of page bodies, evicting least recently
+			validated pages beyond it when pruned; or None for no limit
+		@type max_bytes: int
+		@param max_age: seconds after which unvalidated pages are evicted when pruned;
+			or None to keep them
+		@type max_age: float
+		@param offline: never contact servers, only replay cached pages, however old
+		@type offline: boolean
+		"""
+		self.cache_dir = cache_dir
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		self.offline = offline
+		if not os.path.isdir(cache_dir) : os.makedirs(cache_dir)
+
+	def _entry_file(self, url) :
+		return os.path.join(self.cache_dir, hashlib.sha1(url).hexdigest() + '.json')
+
+	def _body_file(self, digest) :
+		return os.path.join(self.cache_dir, digest + '.body')
+
+	def _write(self, fileName, data) :
+		# write to temporary file first, so concurrent readers never see half of it
+		tmpFileName = '%s.%d.%d.tmp' % (fileName, os.getpid(), threading.current_thread().ident)
+		with open(tmpFileName, 'wb') as f :
+			f.write(data)
+		os.rename(tmpFileName, fileName)
+
+	def get_entry(self, url) :
+		"""Gets cached entry of a URL, or None if it's not cached.
+		"""
+		try :
+			with open(self._entry_file(url), 'rb') as f :
+				entry = json.load(f)
+			if os.path.isfile(self._body_file(entry['digest'])) : return entry
+		except (IOError, ValueError) :
+			pass
+		return None
+
+	def is_fresh(self, entry) :
+		return self.offline or (self.ttl is not None and time.time() - entry['validated'] < self.ttl)
+
+	def get_response(self, url, entry) :
+		"""Rebuilds a requests.Response from a cached entry, with from_cache True.
+		"""
+		response = requests.Response()
+		with open(self._body_file(entry['digest']), 'rb') as f :
+			response._content = f.read()
+		response.status_code = entry['status']
+		response.url = entry['url']
+		response.encoding = entry['encoding']
+		response.headers.update(entry['headers'])
+		response.from_cache = True
+		return response
+
+	def conditional_headers(self, entry) :
+		"""Gets headers to ask the server for a page only if it changed since cached.
+		"""
+		headers = {}
+		if entry['headers'].get('ETag') : headers['If-None-Match'] = entry['headers']['ETag']
+		if entry['headers'].get('Last-Modified') : headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+		return headers
+
+	def store(self, url, response) :
+		"""Caches a successful response to a URL.
+		"""
+		digest = hashlib.sha1(response.content).hexdigest()
+		if not os.path.isfile(self._body_file(digest)) :
+			self._write(self._body_file(digest), response.content)
+		headers = dict((key, response.headers[key]) for key in ('Content-Type', 'ETag', 'Last-Modified')
+			if key in response.headers)
+		entry = {'url': response.url, 'status': response.status_code, 'encoding': response.encoding,
+			'headers': headers, 'digest': digest, 'validated': time.time()}
+		self._write(self._entry_file(url), json.dumps(entry))
+
+	def touch(self, url, entry) :
+		"""Marks a cached entry as just validated, e.g. when the server says it's unchanged.
+		"""
+		entry['validated'] = time.time()
+		self._write(self._entry_file(url), json.dumps(entry))
+
+	def prune(self) :
+		"""Evicts entries older than max_age, then least recently validated entries
+		until page bodies total at most max_bytes, then bodies no entry points to.
+		Returns number of entries evicted.
+		"""
+		entries = []
+		for fileName in os.listdir(self.cache_dir) :
+			if not fileName.endswith('.json') : continue
+			fileName = os.path.join(self.cache_dir, fileName)
+			try :
+				with open(fileName, 'rb') as f :
+					entries.append((json.load(f), fileName))
+			except (IOError, ValueError) :
+				os.remove(fileName)
+		entries.sort(key=lambda item: item[0]['validated'], reverse=True)
+		sizes = {}
+		for entry, fileName in entries :
+			if entry['digest'] not in sizes and os.path.isfile(self._body_file(entry['digest'])) :
+				sizes[entry['digest']] = os.path.getsize(self._body_file(entry['digest']))
+		# keep most recently validated entries, while they fit
+		now = time.time()
+		kept = set()
+		total = 0
+		n_evicted = 0
+		for entry, fileName in entries :
+			digest = entry['digest']
+			size = 0 if digest in kept else sizes.get(digest)
+			if (size is None or (self.max_age is not None and now - entry['validated'] > self.max_age)
+					or (self.max_bytes is not None and total + size > self.max_bytes)) :
+				os.remove(fileName)
+				n_evicted += 1
+				continue
+			kept.add(digest)
+			total += size
+		for digest in set(sizes) - kept :
+			os.remove(self._body_file(digest))
+		return n_evicted
+
+
+class Fetcher(object) :
+	"""Fetches URLs through one pooled requests.Session, shared by up to workers
+	threads, with an optional rate limit, timeouts, retries with exponential
+	backoff, and an optional ResponseCache. Timing of every request is kept in metrics.
+	"""
+
+	def __init__(self, workers=8, rate=None, retries=3, backoff=0.5, timeout=10, cache=None) :
+		"""@param workers: number of URLs fetched concurrently by fetch_many
+		@type workers: int
+		@param rate: maximum requests per second, or None for no limit
+		@type rate: float
+		@param retries: number of times to retry a failed request
+		@type retries: int
+		@param backoff: seconds to wait before the first retry, doubled for each one after
+		@type backoff: float
+		@param timeout: seconds to wait to connect or for data before giving up
+		@type timeout: float
+		@param cache: cache to serve fresh pages from, and to revalidate others against
+		@type cache: ResponseCache
+		"""
+		self.workers = workers
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.cache = cache
+		self.bucket = TokenBucket(rate, max(1, workers)) if rate else None
+		self.session = requests.Session()
+		self.session.headers['User-agent'] = USER_AGENT
+		adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers))
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self.metrics = []
+		self.lock = threading.Lock()
+
+	def get(self, url) :
+		"""Gets a URL, retrying connection errors, timeouts and retryable statuses.
+		Raises the last error if all attempts fail. With a cache, fresh cached pages
+		are returned without a request, stale ones only re-downloaded if changed,
+		and returned as they are if all attempts fail.
+		"""
+		start = time.time()
+		entry = self.cache.get_entry(url) if self.cache is not None else None
+		if entry is not None and self.cache.is_fresh(entry) :
+			self._record(url, 0, 200, start, 'hit')
+			return self.cache.get_response(url, entry)
+		if self.cache is not None and self.cache.offline :
+			self._record(url, 0, 'CacheMiss', start, 'miss')
+			raise CacheMiss('not in cache: ' + url)
+		headers = self.cache.conditional_headers(entry) if entry is not None else {}
+		attempt = 0
+		while True :
+			if self.bucket is not None : self.bucket.acquire()
+			error = None
+			try :
+				response = self.session.get(url, timeout=self.timeout, headers=headers)
+				if response.status_code in RETRY_STATUSES :
+					response.raise_for_status()
+			except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as error :
+				pass
+			if error is None or attempt >= self.retries :
+				break
+			wait = self.backoff * 2 ** attempt
+			# rate limited: wait as long as the server asks, if it says
+			retry_after = getattr(error.response, 'headers', {}).get('Retry-After', '')
+			if retry_after.isdigit() : wait = max(wait, int(retry_after))
+			time.sleep(wait)
+			attempt += 1
+		if error is not None :
+			self._record(url, attempt + 1, repr(error), start, None if entry is None else 'stale')
+			# server is down or failing: an old copy of the page beats none
+			if entry is not None : return self.cache.get_response(url, entry)
+			raise error
+		if entry is not None and response.status_code == 304 :
+			self.cache.touch(url, entry)
+			self._record(url, attempt + 1, 304, start, 'revalidated')
+			return self.cache.get_response(url, entry)
+		self._record(url, attempt + 1, response.status_code, start,
+			None if self.cache is None else 'changed' if entry is not None else 'miss')
+		instrumentation.count('http.bytes', len(response.content))
+		response.raise_for_status()
+		if self.cache is not None : self.cache.store(url, response)
+		response.from_cache = False
+		return response
+
+	def close(self) :
+		"""Closes pooled connections.
+		"""
+		self.session.close()
+
+	def _record(self, url, attempts, status, start, cache) :
+		instrumentation.count('http.requests', attempts)
+		if cache is not None : instrumentation.count('http.cache.' + cache)
+		with self.lock :
+			self.metrics.append({'url': url, 'attempts': attempts, 'status': status,
+				'cache': cache, 'seconds': time.time() - start})
+
+	def fetch_many(self, urls) :
+		"""Lazily fetches urls in a pool of workers threads, yielding (url, response,
+		error) in input order, with error None unless all attempts at a url failed.
+		"""
+		def fetch(url) :
+			try :
+				return url, self.get(url), None
+			except requests.RequestException as error :
+				return url, None, error
+		pool = multiprocessing.pool.ThreadPool(self.workers)
+		try :
+			for result in pool.imap(fetch, urls) :
+				yield result
+		finally :
+			pool.terminate()
+
+	def summary(self) :
+		"""Summarizes timing metrics of requests made so far.
+		"""
+		with self.lock :
+			seconds = sorted(m['seconds'] for m in self.metrics)
+			n_errors = sum(1 for m in self.metrics if not isinstance(m['status'], int) or m['status'] >= 400)
+			n_retries = sum(max(m['attempts'] - 1, 0) for m in self.metrics)
+			n_cache = collections.Counter(m['cache'] for m in self.metrics if m['cache'] is not None)
+		if len(seconds) == 0 : return {'requests': 0}
+		return {'requests': len(seconds), 'errors': n_errors, 'retries': n_retries,
+			'cache': dict(n_cache),
+			'mean': sum(seconds) / len(seconds), 'median': seconds[len(seconds) // 2],
+			'p95': seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))],
+			'max': seconds[-1]}
+
+def scrape_films(film_ids, outFilePattern='box_office_mojo_%s.txt', base_url=BASE_URL,
+		workers=8, rate=None, retries=3, timeout=10, cache_dir=None, ttl=86400,
+		max_bytes=None, offline=False) :
+	"""Fetches weekly box office of many films concurrently, writing each one's
+	chart rows to its own tab-delimited file as soon as it arrives. Films whose
+	pages can't be fetched are reported and skipped, rather than stalling the rest.
+	With a cache_dir, pages are cached there (see ResponseCache), so re-scrapes
+	only download pages that changed, and only parse and write files for those
+	(or for films without a file yet). Offline, cached pages are all re-parsed
+	without any downloads, e.g. to develop the parser.
+	Returns fetcher, whose metrics and summary() describe every request made.
+	"""
+	cache = None
+	if cache_dir is not None :
+		cache = ResponseCache(cache_dir, ttl, max_bytes, offline=offline)
+	fetcher = Fetcher(workers, rate, retries, timeout=timeout, cache=cache)
+	film_ids = list(film_ids)
+	try :
+		results = fetcher.fetch_many(get_film_url(film_id, base_url) for film_id in film_ids)
+		for film_id, (url, response, error) in itertools.izip(film_ids, results) :
+			if error is not None :
+				logger.error('%s: %s', url, error)
+				continue
+			outFileName = outFilePattern % film_id
+			if response.from_cache is True and not offline and os.path.isfile(outFileName) :
+				continue
+			logger.info('URL: %s', response.url)
+			f_out = open(outFileName, 'w')
+			f_csv = csv.writer(f_out, delimiter="\t")
+			rows = parse_film_weekly_box_office(response.text)
+			instrumentation.count('chart.rows', len(rows))
+			f_csv.writerows(rows)
+			f_out.close()
+	finally :
+		fetcher.close()
+	if cache is not None and not offline : cache.prune()
+	return fetcher
 
 docs = [
 	'Forks Over Knives',
@@ -59,8 +482,33 @@ doc_ids = [
 	'sicko'
 	]
 
-for doc_id in doc_ids :
-	f_out = open('box_office_mojo_' + doc_id + '.txt', 'w')
-	f_csv = csv.writer(f_out, delimiter="\t")
-	get_film_weekly_box_office(doc_id)
-	f_out.close()
\ No newline at end of file
+# type_weekly_box_office_row is called once per row
+instrumentation.instrument_module(sys.modules[__name__], exclude=['type_weekly_box_office_row'])
+
+if __name__ == '__main__' :
+	# run options formatted as key=value, e.g. workers=16 rate=5 base_url=http://localhost:8000/movies
+	# cache pages to re-scrape only changed ones: cache_dir=mojo_cache ttl=86400 max_bytes=100000000
+	# ... and replay cached pages without network access: add offline=True
+	# log level, timing stats saved as JSON, cProfile output: log=DEBUG stats=stats.json profile=scrape.prof
+	options = {'base_url': BASE_URL, 'workers': 8, 'rate': None, 'retries': 3, 'timeout': 10}
+	level, statsFileName, profileFileName = 'INFO', None, None
+	for arg in sys.argv[1:] :
+		key, val = arg.split('=')
+		if key in ('base_url', 'cache_dir') : options[key] = val
+		elif key in ('workers', 'retries', 'max_bytes') : options[key] = int(val)
+		elif key in ('rate', 'timeout', 'ttl') : options[key] = float(val)
+		elif key == 'offline' :
+			if val.lower() not in ('true', 'false', '1', '0') :
+				sys.exit('ERROR: offline must be True or False, not %r' % val)
+			options[key] = val.lower() in ('true', '1')
+		elif key == 'log' : level = val.upper()
+		elif key == 'stats' : statsFileName = val
+		elif key == 'profile' : profileFileName = val
+	logging.basicConfig(level=level, format='%(levelname)s: %(message)s')
+	if profileFileName is not None : run = instrumentation.profiled(profileFileName)
+	else : run = instrumentation.timer('box_office_mojo_scraper')
+	with run :
+		fetcher = scrape_films(doc_ids, **options)
+	logger.info('REQUESTS, %s', fetcher.summary())
+	instrumentation.log_summary()
+	if statsFileName is not None : instrumentation.save_summary(statsFileName)
@@ -0,0 +1,272 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import pstats
+import resource
+import StringIO
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# timers and counters are only updated while enabled; disabled wrappers just
+# call through, at the cost of one extra function call
+ENABLED = True
+
+
+################################################################################
+class _Stats(object) :
+    """Totals of all timers and counters since the last reset.
+    """
+
+    def __init__(self) :
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) :
+        with self.lock :
+            # timer name -> [calls, seconds, self seconds, max seconds per call]
+            self.timers = collections.defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+            self.counters = collections.defaultdict(int)
+            self.start = time.time()
+
+
+_stats = _Stats()
+# stack of open timer frames [name, start, seconds spent in nested timers], by thread
+_local = threading.local()
+
+
+################################################################################
+def enable() :
+    global ENABLED
+    ENABLED = True
+
+
+################################################################################
+def disable() :
+    global ENABLED
+    ENABLED = False
+
+
+################################################################################
+def reset() :
+    """Clears all timers and counters.
+    """
+    _stats.reset()
+
+
+################################################################################
+def _get_stack() :
+    stack = getattr(_local, 'stack', None)
+    if stack is None : stack = _local.stack = []
+    return stack
+
+
+################################################################################
+def _enter(name) :
+    frame = [name, time.time(), 0.0]
+    _get_stack().append(frame)
+    return frame
+
+
+################################################################################
+def _add(name, calls, seconds, self_seconds, max_seconds) :
+    with _stats.lock :
+        timer = _stats.timers[name]
+        timer[0] += calls
+        timer[1] += seconds
+        timer[2] += self_seconds
+        if max_seconds > timer[3] : timer[3] = max_seconds
+
+
+################################################################################
+def _exit(frame) :
+    seconds = time.time() - frame[1]
+    stack = _local.stack
+    stack.pop()
+    # nested timers' time is part of this one's total, but not of its self time
+    if stack : stack[-1][2] += seconds
+    _add(frame[0], 1, seconds, seconds - frame[2], seconds)
+
+
+################################################################################
+@contextlib.contextmanager
+def timer(name) :
+    """Times a block of code under name, e.g. with timer('parse') : ...
+    """
+    if ENABLED is False :
+        yield
+        return
+    frame = _enter(name)
+    try :
+        yield
+    finally :
+        _exit(frame)
+
+
+################################################################################
+def count(name, n=1) :
+    """Adds n to counter name, e.g. of documents, tokens or bytes processed.
+    """
+    if ENABLED is False : return
+    with _stats.lock :
+        _stats.counters[name] += n
+
+
+################################################################################
+def _iter_timed(name, items) :
+    """Times each step of an iterator under name, as one call in all. Steps are
+    totalled locally and added to the timer once, when the iterator is done, as
+    pipeline generators may take millions of steps.
+    """
+    frame = [name, 0.0, 0.0]
+    seconds = max_seconds = 0.0
+    # taken at the first step, as the generator is consumed in a single thread
+    stack = None
+    clock = time.time
+    try :
+        while True :
+            if ENABLED is False :
+                try :
+                    item = next(items)
+                except StopIteration :
+                    return
+            else :
+                if stack is None : stack = _get_stack()
+                stack.append(frame)
+                start = clock()
+                try :
+                    item = next(items)
+                except StopIteration :
+                    return
+                finally :
+                    step = clock() - start
+                    stack.pop()
+                    if stack : stack[-1][2] += step
+                    seconds += step
+                    if step > max_seconds : max_seconds = step
+            yield item
+    finally :
+        if hasattr(items, 'close') : items.close()
+        if stack is not None : _add(name, 1, seconds, seconds - frame[2], max_seconds)
+
+
+################################################################################
+def timed(name=None) :
+    """Decorator timing every call of a function under name, by default its
+    module and name. Generator functions are timed over all steps of the
+    generator they return, as they do their work while being iterated over.
+    """
+    def decorator(func) :
+        timer_name = name or '%s.%s' % (func.__module__, func.__name__)
+        if inspect.isgeneratorfunction(func) :
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs) :
+                return _iter_timed(timer_name, func(*args, **kwargs))
+        else :
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs) :
+                if ENABLED is False : return func(*args, **kwargs)
+                frame = _enter(timer_name)
+                try :
+                    return func(*args, **kwargs)
+                finally :
+                    _exit(frame)
+        wrapper.__wrapped__ = func
+        return wrapper
+    return decorator
+
+
+################################################################################
+def instrument_module(module, exclude=()) :
+    """Times all public functions of a module, and public methods of its public
+    classes, by replacing them with timed versions (see timed). Only functions
+    and classes defined in the module itself are instrumented, each only once.
+    Call at the end of a module as instrument_module(sys.modules[__name__]).
+    @param exclude: names of functions or 'Class.method's not to instrument,
+        e.g. ones called so often that even timing them would be slow
+    @type exclude: list of strings
+    """
+    for name, obj in vars(module).items() :
+        if name.startswith('_') or name in exclude : continue
+        if getattr(obj, '__module__', None) != module.__name__ : continue
+        if inspect.isfunction(obj) and not hasattr(obj, '__wrapped__') :
+            setattr(module, name, timed()(obj))
+        elif inspect.isclass(obj) and not issubclass(obj, BaseException) :
+            for attr, method in vars(obj).items() :
+                method_name = '%s.%s' % (name, attr)
+                if attr.startswith('_') or method_name in exclude : continue
+                if inspect.isfunction(method) and not hasattr(method, '__wrapped__') :
+                    setattr(obj, attr, timed('%s.%s' % (module.__name__, method_name))(method))
+
+
+################################################################################
+def peak_memory() :
+    """Gets peak resident memory of this process so far, in MB.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS X
+    return maxrss / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+################################################################################
+@contextlib.contextmanager
+def profiled(fileName=None, sort='cumulative', limit=30) :
+    """Profiles a block of code with cProfile, saving stats to fileName (for
+    pstats or snakeviz) if given, and logging the limit top functions at DEBUG.
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try :
+        yield profile
+    finally :
+        profile.disable()
+        if fileName is not None : profile.dump_stats(fileName)
+        if logger.isEnabledFor(logging.DEBUG) :
+            out = StringIO.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats(sort).print_stats(limit)
+            logger.debug('profile:\n%s', out.getvalue())
+
+
+################################################################################
+def summary() :
+    """Summarizes all timers and counters since the last reset, with timers
+    sorted by self time: time spent in them, but not in other timers they called.
+    """
+    with _stats.lock :
+        timers = [(name, {'calls': t[0], 'seconds': t[1], 'self_seconds': t[2],
+                          'max_seconds': t[3]})
+                  for name, t in _stats.timers.iteritems()]
+        counters = dict(_stats.counters)
+        wall = time.time() - _stats.start
+    timers.sort(key=lambda item: item[1]['self_seconds'], reverse=True)
+    return {'wall_seconds': wall, 'peak_memory_mb': peak_memory(),
+            'timers': collections.OrderedDict(timers), 'counters': counters}
+
+
+################################################################################
+def save_summary(fileName) :
+    """Saves summary as JSON.
+    """
+    with open(fileName, 'w') as f :
+        json.dump(summary(), f, indent=1)
+
+
+################################################################################
+def log_summary(level=logging.INFO, limit=20) :
+    """Logs counters and the limit timers with the most self time.
+    """
+    stats = summary()
+    logger.log(level, 'wall time = %.3f s, peak memory = %.1f MB',
+               stats['wall_seconds'], stats['peak_memory_mb'])
+    for name, timer in stats['timers'].items()[:limit] :
+        logger.log(level, '... %s: %d calls, %.3f s (self %.3f s, max %.3f s)', name,
+                   timer['calls'], timer['seconds'], timer['self_seconds'], timer['max_seconds'])
+    for name, n in sorted(stats['counters'].iteritems()) :
+        logger.log(level, '... %s = %d', name, n)
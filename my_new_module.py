@@ -1,49 +1,373 @@
-
+import array
+import calendar
+import collections
 import csv
+import datetime
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import mmap
+import multiprocessing
+import os
 import re
 import sys
 
+import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+# pub_date_iso and pub_date_epoch came later, so they go last, keeping the
+# original columns at their positions in TSV output
+KEYS = ['pub', 'pub_date', 'show', 'anchors', 'guests', 'blog', 'byline',
+    'section', 'length', 'load_date', 'language', 'pub_type', 'journal_code',
+    'copyright', 'article_text', 'pub_date_iso', 'pub_date_epoch']
+
+# LexisNexis separates documents with "X of Y DOCUMENTS" lines
+DOC_SEPARATOR = re.compile(r'\d+ of \d+ DOCUMENTS')
+
+# metadata kept in index files for random access to documents, by default
+# saved next to the LexisNexis output file with this extension
+INDEX_KEYS = ['pub', 'pub_date', 'pub_date_iso', 'section']
+INDEX_EXTENSION = '.idx'
+INDEX_VERSION = 2
+
+# header line prefix -> (key in KEYS, lowercase value or not)
+HEADER_FIELDS = {
+    'SHOW: ': ('show', False),
+    'ANCHORS: ': ('anchors', False),
+    'GUESTS: ': ('guests', False),
+    'BLOG: ': ('blog', False),
+    'BYLINE: ': ('byline', False),
+    'SECTION: ': ('section', False),
+    'LENGTH: ': ('length', False),
+    'LANGUAGE:': ('language', True),
+    'LOAD-DATE: ': ('load_date', False),
+    'PUBLICATION-TYPE: ': ('pub_type', True),
+    'JOURNAL-CODE: ': ('journal_code', False),
+    'Copyright ': ('copyright', False),
+    }
 
 
 ################################################################################
-def parse_lexis_nexis(inFileName,
-                      outFileName = 'lexis_nexis_output.txt',
-                      doPrint = False) :
-    """Parses documents output by LexisNexis, saves structured data to file.
+def _compile_header_prefixes() :
+    """Compiles all HEADER_FIELDS prefixes into a single alternation regex.
+    """
+    # longest first, so a prefix never shadows a longer one that contains it
+    prefixes = sorted(HEADER_FIELDS, key=len, reverse=True)
+    return re.compile('|'.join(re.escape(prefix) for prefix in prefixes))
 
-    @param inFileName: Path to and name of file containing LexisNexis output.
+_header_prefixes = _compile_header_prefixes()
+
+
+MONTHS = ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+    'August', 'September', 'October', 'November', 'December')
+
+# LexisNexis date lines, e.g. "March 4, 2012 Monday Late Edition - Final" or
+# "March 4, 2012 Monday 10:30 PM EST"; anything after the year is ignored
+PUB_DATE = re.compile(r'(%s)\s+(\d{1,2}),?\s+(\d{4})\b' % '|'.join(MONTHS))
+PUB_DATE_CACHE_SIZE = 100000
+
+# memoized (ISO date, epoch) by date line, as exports repeat the same few dates
+_pub_dates = {}
+# memoized ISO dates of date range bounds, checked once per document
+_date_bounds = {}
+
+# document text is split into lines on these
+LINE_BREAK = re.compile('\r\n|\n\n')
+
+
+################################################################################
+def parse_pub_date(pub_date) :
+    """Parses a LexisNexis date line into an ISO date ('YYYY-MM-DD') and the
+    Unix epoch seconds of that date's midnight UTC; times and time zones are
+    ignored, so the date is always the one printed. Results are memoized.
+    return: (ISO date, epoch), or ('NA', 'NA') if no full date is found
+    """
+    try :
+        return _pub_dates[pub_date]
+    except KeyError :
+        pass
+    match = PUB_DATE.search(pub_date)
+    result = ('NA', 'NA')
+    if match is not None :
+        month, day, year = MONTHS.index(match.group(1)) + 1, int(match.group(2)), int(match.group(3))
+        if 1 <= day <= calendar.monthrange(year, month)[1] :
+            result = ('%04d-%02d-%02d' % (year, month, day),
+                      calendar.timegm((year, month, day, 0, 0, 0)))
+    if len(_pub_dates) >= PUB_DATE_CACHE_SIZE : _pub_dates.clear()
+    _pub_dates[pub_date] = result
+    return result
+
+
+################################################################################
+def parse_date_bound(date) :
+    """Checks a bound of a publication date range, as 'YYYY-MM-DD' or a
+    datetime.date, and gets it as an ISO date comparable to pub_date_iso, or
+    None if date is None. Raises ValueError for anything else, e.g. '2012-3-1',
+    which would compare wrongly as a string.
+    """
+    if date is None : return None
+    if isinstance(date, datetime.datetime) : date = date.date()
+    if isinstance(date, datetime.date) : return date.isoformat()
+    try :
+        return _date_bounds[date]
+    except (KeyError, TypeError) :
+        pass
+    try :
+        iso = datetime.datetime.strptime(date, '%Y-%m-%d').date().isoformat()
+    except (ValueError, TypeError) :
+        iso = None
+    # strptime also takes e.g. '2012-3-1'
+    if iso != date :
+        raise ValueError("date must be a datetime.date or 'YYYY-MM-DD', not %r" % (date,))
+    _date_bounds[date] = iso
+    return iso
+
+
+################################################################################
+def register_lexis_nexis_field(prefix, key, lower = False) :
+    """Registers a custom header field to be extracted from LexisNexis documents.
+    Lines starting with prefix are stored under key instead of in article text;
+    new keys are added to KEYS just before 'article_text'.
+
+    @param prefix: Start of header line, e.g. 'DATELINE: '
     @type: string
-    @param outFileName: Path to and name of output file for parsed LexisNexis data.
+    @param key: Name of field in parsed output
     @type: string
-    @param doPrint: Print document metadata and text.
+    @param lower: Lowercase the field value.
     @type: boolean
     """
+    global _header_prefixes
+    HEADER_FIELDS[prefix] = (key, lower)
+    if key not in KEYS : KEYS.insert(KEYS.index('article_text'), key)
+    _header_prefixes = _compile_header_prefixes()
+
 
-    print "\nINFO: RUN OPTIONS"
-    print "... in =", inFileName
-    print "... out =", outFileName
-    print "... print =", doPrint
+################################################################################
+def iter_lexis_nexis_chunks(inFile) :
+    """Yields raw text of LexisNexis output piece by piece: first the cover page,
+    then each document, split on "X of Y DOCUMENTS" lines.
 
-    # input/output files
-    inFile = open(inFileName, 'r')
-    outFile = open(outFileName, 'w')
-    KEYS = ['pub', 'pub_date', 'show', 'anchors', 'guests', 'blog', 'byline',
-        'section', 'length', 'load_date', 'language', 'pub_type', 'journal_code',
-        'copyright', 'article_text']
-    csv_writer = csv.DictWriter(outFile, KEYS, delimiter="\t")
-    csv_writer.writeheader()
+    @param inFile: File (or any iterable of lines) containing LexisNexis output.
+    @type: file
+    """
+    # only the lines of the current document are ever held in memory
+    chunk = []
+    for line in inFile :
+        pieces = DOC_SEPARATOR.split(line)
+        for piece in pieces[:-1] :
+            chunk.append(piece)
+            chunk = ''.join(chunk)
+            instrumentation.count('lexis_nexis.bytes', len(chunk))
+            yield chunk
+            chunk = []
+        chunk.append(pieces[-1])
+    chunk = ''.join(chunk)
+    instrumentation.count('lexis_nexis.bytes', len(chunk))
+    yield chunk
 
-    # split LexisNexis document on "X of Y DOCUMENTS" lines
-    docs = re.split(r'\d+ of \d+ DOCUMENTS', inFile.read())
 
-    # get cover page search info if available
-    cover = docs[0]
+################################################################################
+def parse_lexis_nexis_cover(cover) :
+    """Gets download request, search terms and sources from LexisNexis cover page.
+    Values not found are returned as None.
+    """
     dwnldreqs = re.search(r'^Download Request: .*', cover, re.MULTILINE)
     if dwnldreqs is not None : dwnldreqs = dwnldreqs.group()
     terms = re.search(r'^Terms: .*(\n.*){2}', cover, re.MULTILINE)
     if terms is not None : terms = terms.group()
     sources = re.search(r'^Source: .*', cover, re.MULTILINE)
     if sources is not None : sources = sources.group()
+    return dwnldreqs, terms, sources
+
+
+################################################################################
+def sort_header_lines(lines, row) :
+    """Sorts document lines into metadata and article text in a single pass,
+    looking up each line's header prefix (if any) in HEADER_FIELDS.
+    Metadata is stored in row; remaining article text lines are returned.
+    """
+    body = []
+    end = len(lines)
+    for i, line in enumerate(lines) :
+        match = _header_prefixes.match(line)
+        if match is None :
+            if i < end : body.append(line)
+            continue
+        key, lower = HEADER_FIELDS[match.group()]
+        value = line[match.end():]
+        row[key] = value.lower() if lower is True else value
+        if key == 'copyright' :
+            # also get rid of 'All Rights Reserved', i.e. the last 3 lines
+            drop = 3 - max(end - i, 0)
+            if drop > 0 : del body[max(len(body) - drop, 0):]
+            if i < end :
+                end = max(end - 3, i)
+                if i < end : body.append(line)
+    return body
+
+
+################################################################################
+def _get_head_lines(doc, n = 3) :
+    """Gets the first n stripped, non-empty lines of a document (or all, if
+    fewer), splitting only as much of the document as needed.
+    """
+    maxsplit = 2 * n
+    while True :
+        pieces = LINE_BREAK.split(doc, maxsplit)
+        more = len(pieces) > maxsplit
+        if more : pieces.pop()
+        head = [piece.strip() for piece in pieces if piece != '']
+        if len(head) >= n or not more : return head[:n]
+        maxsplit *= 4
+
+
+################################################################################
+def parse_lexis_nexis_doc(doc, date_from = None, date_to = None) :
+    """Parses raw text of a single LexisNexis document into a dict keyed by KEYS,
+    with default value 'NA' for any missing metadata.
+
+    @param date_from: Earliest publication date to parse, as 'YYYY-MM-DD' (or a
+        datetime.date); documents published earlier, or with no date found, are
+        skipped before their text is processed, and None is returned.
+    @type: string
+    @param date_to: Latest publication date to parse, likewise.
+    @type: string
+    """
+    filtered = date_from is not None or date_to is not None
+    if filtered is True :
+        date_from, date_to = parse_date_bound(date_from), parse_date_bound(date_to)
+        # split off just enough to check the date, in case the doc is skipped
+        head = _get_head_lines(doc)
+    else :
+        # clean up white space
+        lines = LINE_BREAK.split(doc)
+        lines = [line.strip() for line in lines if line != '']
+        head = lines[:3]
+    # get leading metadata; special care taken with dates to avoid errors
+    row = {}
+    for key in KEYS : row[key] = 'NA'
+    row['pub'] = head[0]
+    if head[1].startswith(MONTHS) :
+        row['pub_date'] = head[1]
+        n_head = 2
+    else :
+        row['pub'] += ' ' + head[1]
+        row['pub_date'] = head[2]
+        n_head = 3
+    row['pub_date_iso'], row['pub_date_epoch'] = parse_pub_date(row['pub_date'])
+    if filtered is True :
+        pub_date = row['pub_date_iso']
+        if pub_date == 'NA' : return None
+        if date_from is not None and pub_date < date_from : return None
+        if date_to is not None and pub_date > date_to : return None
+        lines = LINE_BREAK.split(doc)
+        lines = [line.strip() for line in lines if line != '']
+    del lines[0:n_head]
+    # sort remaining lines into metadata and article text
+    body = sort_header_lines(lines, row)
+
+    # all remaining lines should be article text
+    article_text = ' '.join(body)
+    row['article_text'] = re.sub(r'\s', ' ', article_text)
+    return row
+
+
+################################################################################
+def print_lexis_nexis_doc(row) :
+    """Helpful printout of parsed LexisNexis document metadata and text.
+    """
+    print "\nPUBLICATION:", row['pub']
+    print "PUB-DATE:", row['pub_date']
+    print "ANCHORS:", row['anchors']
+    print "GUESTS:", row['guests']
+    print "SHOW:", row['show']
+    print "BLOG:", row['blog']
+    print "BYLINE:", row['byline']
+    print "SECTION:", row['section']
+    print "LENGTH:", row['length']
+    print "LOAD-DATE:", row['load_date']
+    print "LANGUAGE:", row['language']
+    print "PUB-TYPE:", row['pub_type']
+    print "JOURNAL-CODE:", row['journal_code']
+    print "COPYRIGHT:", row['copyright']
+    print "ARTICLE TEXT:", "\n", row['article_text']
+
+
+################################################################################
+def _parse_lexis_nexis_docs(docs, date_from = None, date_to = None) :
+    """Parses a batch of raw LexisNexis documents, dropping any out of the date
+    range; run in worker processes.
+    """
+    rows = [parse_lexis_nexis_doc(doc, date_from, date_to) for doc in docs]
+    return [row for row in rows if row is not None]
+
+
+################################################################################
+def _iter_parsed_in_pool(docs, workers, ordered, chunksize, date_from = None,
+                         date_to = None) :
+    """Parses raw documents in a pool of worker processes, chunksize at a time,
+    yielding rows in original order (or as soon as they're ready if not ordered),
+    except those out of the date range.
+    At most 2 chunks per worker are in flight, so memory use stays bounded.
+    """
+    pool = multiprocessing.Pool(workers)
+    pending = collections.deque()
+    docs = iter(docs)
+    try :
+        while True :
+            batch = list(itertools.islice(docs, chunksize))
+            if batch : pending.append(pool.apply_async(_parse_lexis_nexis_docs,
+                                                      (batch, date_from, date_to)))
+            if len(pending) == 0 : break
+            if batch and len(pending) < 2 * workers : continue
+            # collect the oldest chunk, or any finished one if order doesn't matter
+            result = pending[0]
+            if ordered is False :
+                for r in pending :
+                    if r.ready() is True :
+                        result = r
+                        break
+            pending.remove(result)
+            for row in result.get() : yield row
+        pool.close()
+    finally :
+        pool.terminate()
+        pool.join()
+
+
+################################################################################
+def iter_lexis_nexis_docs(inFile, doPrint = False, workers = 1, ordered = True,
+                          chunksize = 64, date_from = None, date_to = None) :
+    """Parses documents output by LexisNexis, yielding one dict of structured
+    data per document as it is read. Peak memory is bounded by the largest
+    single document rather than the whole file.
+
+    @param inFile: File (or any iterable of lines) containing LexisNexis output.
+    @type: file
+    @param doPrint: Print cover page info, document metadata and text.
+    @type: boolean
+    @param workers: Number of processes parsing documents in parallel.
+    @type: int
+    @param ordered: Yield documents in original order; if False, yield them in
+        whatever order parallel workers finish them.
+    @type: boolean
+    @param chunksize: Number of documents sent to a worker at a time.
+    @type: int
+    @param date_from: Earliest publication date to yield, as 'YYYY-MM-DD'; earlier
+        documents (and any without a date) are skipped without parsing their text.
+    @type: string
+    @param date_to: Latest publication date to yield, as 'YYYY-MM-DD'.
+    @type: string
+    """
+    date_from, date_to = parse_date_bound(date_from), parse_date_bound(date_to)
+    chunks = iter_lexis_nexis_chunks(inFile)
+
+    # get cover page search info if available
+    dwnldreqs, terms, sources = parse_lexis_nexis_cover(next(chunks))
     if doPrint is True :
         print "\nINFO: COVER PAGE"
         print "...", dwnldreqs
@@ -51,94 +375,549 @@ def parse_lexis_nexis(inFileName,
         print "...", sources
 
     # iterate over documents
-    for doc in docs[1:] :
-        # clean up white space
-        lines = re.split('\r\n|\n\n', doc)
-        lines = [line.strip() for line in lines if line != '']
-        # create dict of all data with default value 'NA'
-        row = {}
-        for key in KEYS : row[key] = 'NA'
-        # get leading metadata; special care taken with dates to avoid errors
-        row['pub'] = lines[0]
-        months = ['January', 'February', 'March', 'April', 'May', 'June',
-            'July', 'August', 'September', 'October', 'November', 'December']
-        for month in months :
-            if lines[1].startswith(month) :
-                row['pub_date'] = lines[1]
-                del lines[0:2]
-                break
-        if row['pub_date'] == 'NA' :
-            row['pub'] += ' ' + lines[1]
-            row['pub_date'] = lines[2]
-            del lines[0:3]
-
-        #row['pub_date'] = lines[1]    # rarely errs
-        #del lines[0:2]
-        # get remaining metadata, set default to 'NA'
-        # by iterating over lines in document
-        for line in lines[:] :
-            if line.startswith('SHOW: ') :
-                row['show'] = line[len('SHOW: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('ANCHORS: ') :
-                row['anchors'] = line[len('ANCHORS: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('GUESTS: ') :
-                row['guests'] = line[len('GUESTS: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('BLOG: ') :
-                row['blog'] = line[len('BLOG: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('BYLINE: ') :
-                row['byline'] = line[len('BYLINE: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('SECTION: ') :
-                row['section'] = line[len('SECTION: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('LENGTH: ') :
-                row['length'] = line[len('LENGTH: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('LANGUAGE:') :
-                row['language'] = line[len('LANGUAGE:'):].lower()
-                del lines[lines.index(line)]
-            elif line.startswith('LOAD-DATE: ') :
-                row['load_date'] = line[len('LOAD-DATE: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('PUBLICATION-TYPE: ') :
-                row['pub_type'] = line[len('PUBLICATION-TYPE: '):].lower()
-                del lines[lines.index(line)]
-            elif line.startswith('JOURNAL-CODE: ') :
-                row['journal_code'] = line[len('JOURNAL-CODE: '):]
-                del lines[lines.index(line)]
-            elif line.startswith('Copyright ') :
-                row['copyright'] = line[len('Copyright '):]
-                # also get rid of 'All Rights Reserved'
-                del lines[-3:]
-
-        # all remaining lines should be article text
-        article_text = ' '.join(lines)
-        row['article_text'] = re.sub(r'\s', ' ', article_text)
-
-        # helpful printout
-        if doPrint is True :
-            print "\nPUBLICATION:", row['pub']
-            print "PUB-DATE:", row['pub_date']
-            print "ANCHORS:", row['anchors']
-            print "GUESTS:", row['guests']
-            print "SHOW:", row['show']
-            print "BLOG:", row['blog']
-            print "BYLINE:", row['byline']
-            print "SECTION:", row['section']
-            print "LENGTH:", row['length']
-            print "LOAD-DATE:", row['load_date']
-            print "LANGUAGE:", row['language']
-            print "PUB-TYPE:", row['pub_type']
-            print "JOURNAL-CODE:", row['journal_code']
-            print "COPYRIGHT:", row['copyright']
-            print "ARTICLE TEXT:", "\n", row['article_text']
-
-        csv_writer.writerow(row)
-
-    inFile.close()
-    print "\nINFO: output saved to", outFileName
-    outFile.close()
+    if workers > 1 :
+        rows = _iter_parsed_in_pool(chunks, workers, ordered, chunksize, date_from, date_to)
+    else :
+        rows = (parse_lexis_nexis_doc(chunk, date_from, date_to) for chunk in chunks)
+    for row in rows :
+        if row is None :
+            instrumentation.count('lexis_nexis.skipped')
+            continue
+        instrumentation.count('lexis_nexis.documents')
+        if doPrint is True : print_lexis_nexis_doc(row)
+        yield row
+
+
+################################################################################
+class TSVWriter(object) :
+    """Writes parsed LexisNexis rows to a tab-delimited file, with 'NA' for
+    missing values.
+    """
+    extension = '.tsv'
+    appendable = True
+
+    def __init__(self, outFileName, keys = None, append = False) :
+        self.outFile = open(outFileName, 'a' if append is True else 'w')
+        self.csv_writer = csv.DictWriter(self.outFile, keys or KEYS, delimiter="\t")
+        if append is False : self.csv_writer.writeheader()
+
+    def writerow(self, row) :
+        self.csv_writer.writerow(row)
+
+    def flush(self) :
+        self.outFile.flush()
+
+    def close(self) :
+        self.outFile.close()
+
+
+################################################################################
+class ParquetWriter(object) :
+    """Writes parsed LexisNexis rows to a columnar Parquet file (requires pyarrow),
+    batchsize rows per row group. Missing values are stored as real nulls rather
+    than 'NA', and low-cardinality metadata columns are dictionary-encoded, so
+    metadata can be read back cheaply without touching article text.
+    """
+    extension = '.parquet'
+    appendable = False
+    DICTIONARY_KEYS = ['pub', 'section', 'language', 'pub_type']
+    INT_KEYS = ['pub_date_epoch']
+
+    def __init__(self, outFileName, keys = None, append = False,
+                 batchsize = 10000, encoding = 'utf-8') :
+        if append is True :
+            raise ValueError("Parquet files can't be appended to; write one file per input instead")
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.keys = list(keys or KEYS)
+        self.batchsize = batchsize
+        self.encoding = encoding
+        dict_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        self.schema = pyarrow.schema([
+            pyarrow.field(key, dict_type if key in self.DICTIONARY_KEYS else
+                          pyarrow.int64() if key in self.INT_KEYS else pyarrow.string())
+            for key in self.keys])
+        self.writer = pyarrow.parquet.ParquetWriter(outFileName, self.schema,
+            use_dictionary=[key for key in self.keys if key in self.DICTIONARY_KEYS],
+            compression='snappy')
+        self.rows = []
+
+    def writerow(self, row) :
+        self.rows.append(row)
+        if len(self.rows) >= self.batchsize : self.flush()
+
+    def flush(self) :
+        """Writes buffered rows to file as one row group.
+        """
+        if len(self.rows) == 0 : return
+        arrays = []
+        for key in self.keys :
+            values = [row.get(key, 'NA') for row in self.rows]
+            if key in self.INT_KEYS :
+                values = [None if value == 'NA' else value for value in values]
+                arrays.append(self.pyarrow.array(values, type=self.pyarrow.int64()))
+                continue
+            values = [None if value == 'NA' else value.decode(self.encoding, 'replace')
+                      for value in values]
+            array = self.pyarrow.array(values, type=self.pyarrow.string())
+            if key in self.DICTIONARY_KEYS : array = array.dictionary_encode()
+            arrays.append(array)
+        table = self.pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(self.rows))
+        self.rows = []
+
+    def close(self) :
+        self.flush()
+        self.writer.close()
+
+
+WRITERS = {'tsv': TSVWriter, 'parquet': ParquetWriter}
+
+
+################################################################################
+def get_writer(writer) :
+    """Gets writer class from its name in WRITERS; any other writer (a class or
+    function taking outFileName, keys and append and returning an object with
+    writerow, flush and close methods) is returned as is.
+    """
+    if isinstance(writer, basestring) :
+        if writer not in WRITERS :
+            raise NameError("'writer' must be one of " + ', '.join(sorted(WRITERS)))
+        return WRITERS[writer]
+    return writer
+
+
+################################################################################
+def read_lexis_nexis_parquet(inFileName, columns = None) :
+    """Reads parsed LexisNexis data saved by ParquetWriter into a pyarrow Table.
+    @param columns: Names of columns to read; others (e.g. 'article_text') are
+        skipped on disk entirely. All columns are read by default.
+    @type: list of strings
+    """
+    import pyarrow.parquet
+    return pyarrow.parquet.read_table(inFileName, columns=columns)
+
+
+################################################################################
+def parse_lexis_nexis(inFileName,
+                      outFileName = 'lexis_nexis_output.txt',
+                      doPrint = False,
+                      workers = 1,
+                      ordered = True,
+                      writer = 'tsv',
+                      date_from = None,
+                      date_to = None) :
+    """Parses documents output by LexisNexis, saves structured data to file.
+
+    @param inFileName: Path to and name of file containing LexisNexis output.
+    @type: string
+    @param outFileName: Path to and name of output file for parsed LexisNexis data.
+    @type: string
+    @param doPrint: Print document metadata and text.
+    @type: boolean
+    @param workers: Number of processes parsing documents in parallel.
+    @type: int
+    @param ordered: Write documents in original order; if False, write them in
+        whatever order parallel workers finish them.
+    @type: boolean
+    @param writer: Output format, 'tsv' or 'parquet', or a custom writer
+        (see get_writer).
+    @type: string
+    @param date_from: Earliest publication date to save, as 'YYYY-MM-DD'.
+    @type: string
+    @param date_to: Latest publication date to save, as 'YYYY-MM-DD'.
+    @type: string
+    """
+    # checked before the output is overwritten
+    date_from, date_to = parse_date_bound(date_from), parse_date_bound(date_to)
+
+    logger.info("RUN OPTIONS")
+    logger.info("... in = %s", inFileName)
+    logger.info("... out = %s", outFileName)
+    logger.info("... print = %s", doPrint)
+    logger.info("... workers = %s", workers)
+    logger.info("... ordered = %s", ordered)
+    logger.info("... writer = %s", writer)
+    logger.info("... dates = %s to %s", date_from, date_to)
+
+    # input/output files, closed even if parsing fails, so e.g. a Parquet
+    # file still gets its footer
+    with open(inFileName, 'r') as inFile :
+        out = get_writer(writer)(outFileName, KEYS)
+        try :
+            for row in iter_lexis_nexis_docs(inFile, doPrint=doPrint, workers=workers,
+                                             ordered=ordered, date_from=date_from,
+                                             date_to=date_to) :
+                out.writerow(row)
+        finally :
+            out.close()
+    logger.info("output saved to %s", outFileName)
+
+
+################################################################################
+def find_lexis_nexis_files(inPattern) :
+    """Gets sorted list of files given a directory, a glob pattern like
+    'exports/*.txt', or a single file name.
+    """
+    if os.path.isdir(inPattern) : inPattern = os.path.join(inPattern, '*')
+    return sorted(f for f in glob.glob(inPattern) if os.path.isfile(f))
+
+
+################################################################################
+def hash_file(fileName, blocksize = 1 << 20) :
+    """Gets SHA-1 hex digest of a file's contents, read blocksize bytes at a time.
+    """
+    sha1 = hashlib.sha1()
+    with open(fileName, 'rb') as f :
+        for block in iter(lambda: f.read(blocksize), '') :
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+################################################################################
+def load_manifest(manifestFileName) :
+    """Loads manifest of already-parsed files, {'options': parse options and
+    output columns, 'files': {path: {'size', 'mtime', 'sha1'}}}, with no options
+    and files if there is none yet (or if it predates options).
+    """
+    if not os.path.exists(manifestFileName) : return {'options': None, 'files': {}}
+    with open(manifestFileName, 'r') as f :
+        manifest = json.load(f)
+    if 'files' not in manifest : manifest = {'options': None, 'files': manifest}
+    return manifest
+
+
+################################################################################
+def save_manifest(manifest, manifestFileName) :
+    """Saves manifest of parsed files; written to a temporary file first, so an
+    interrupted run never leaves a truncated manifest behind.
+    """
+    tmpFileName = manifestFileName + '.tmp'
+    with open(tmpFileName, 'w') as f :
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmpFileName, manifestFileName)
+
+
+################################################################################
+def check_manifest(fileName, manifest) :
+    """Checks a file against its manifest entry.
+    Files with unchanged size and mtime are assumed unchanged without hashing;
+    otherwise contents are hashed, so touched-but-identical files are skipped too.
+    @param manifest: Entries of parsed files in a manifest, by path
+    @type: dict
+    return: (changed, entry) with entry the file's up-to-date manifest entry
+    """
+    stat = os.stat(fileName)
+    old = manifest.get(os.path.abspath(fileName))
+    if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime :
+        return False, old
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': hash_file(fileName)}
+    changed = old is None or old['sha1'] != entry['sha1']
+    # touched but identical: keep where its output went
+    if changed is False : entry = dict(old, **entry)
+    return changed, entry
+
+
+################################################################################
+def parse_lexis_nexis_batch(inPattern,
+                            outFileName = 'lexis_nexis_output.txt',
+                            manifestFileName = None,
+                            shard = False,
+                            doPrint = False,
+                            workers = 1,
+                            ordered = True,
+                            writer = 'tsv',
+                            date_from = None,
+                            date_to = None) :
+    """Parses many LexisNexis output files, skipping any already parsed.
+    A manifest records each input's path, size, mtime and content hash; only
+    new or changed files are parsed on later runs. It also records the date
+    range, writer and output columns (KEYS); if any differ, all files are reparsed.
+
+    @param inPattern: Directory, glob pattern or list of LexisNexis output files.
+    @type: string or list of strings
+    @param outFileName: Path to and name of output file for parsed LexisNexis data
+        or, if shard is True, of output directory for one file per input.
+    @type: string
+    @param manifestFileName: Path to and name of manifest file; by default
+        outFileName + '.manifest.json'
+    @type: string
+    @param shard: Write each input to its own output file instead of one file,
+        named after the input, plus a hash of its path if another input has the
+        same name. Changed inputs then only rewrite their own shard; with a
+        single output file new inputs are appended, but a changed input
+        rewrites everything. Rows of inputs that failed partway through are
+        truncated from the single output file before appending.
+    @type: boolean
+    @param doPrint: Print document metadata and text.
+    @type: boolean
+    @param workers: Number of processes parsing documents in parallel.
+    @type: int
+    @param ordered: Write documents in original order; if False, write them in
+        whatever order parallel workers finish them.
+    @type: boolean
+    @param writer: Output format, 'tsv' or 'parquet', or a custom writer
+        (see get_writer). Writers that can't append require shard to be True.
+    @type: string
+    @param date_from: Earliest publication date to save, as 'YYYY-MM-DD'.
+    @type: string
+    @param date_to: Latest publication date to save, as 'YYYY-MM-DD'.
+    @type: string
+    """
+    writer_class = get_writer(writer)
+    if shard is False and getattr(writer_class, 'appendable', False) is False :
+        raise ValueError("output format can't be appended to, so shard must be True")
+    # kept in the manifest as ISO dates, so equal dates given either way match
+    date_from, date_to = parse_date_bound(date_from), parse_date_bound(date_to)
+    if isinstance(inPattern, basestring) :
+        inFileNames = find_lexis_nexis_files(inPattern)
+    else :
+        inFileNames = list(inPattern)
+    if manifestFileName is None :
+        manifestFileName = outFileName.rstrip(os.sep) + '.manifest.json'
+
+    logger.info("RUN OPTIONS")
+    logger.info("... in = %s (%d files)", inPattern, len(inFileNames))
+    logger.info("... out = %s", outFileName)
+    logger.info("... manifest = %s", manifestFileName)
+    logger.info("... shard = %s", shard)
+    logger.info("... print = %s", doPrint)
+    logger.info("... workers = %s", workers)
+    logger.info("... ordered = %s", ordered)
+    logger.info("... writer = %s", writer)
+    logger.info("... dates = %s to %s", date_from, date_to)
+
+    # outputs are gone, or hold other dates or columns, so start over
+    options = {'date_from': date_from, 'date_to': date_to, 'keys': list(KEYS),
+               'writer': writer if isinstance(writer, basestring) else
+                         '%s.%s' % (writer_class.__module__, writer_class.__name__)}
+    manifest = load_manifest(manifestFileName)
+    if not os.path.exists(outFileName) :
+        manifest['files'] = {}
+    elif manifest['files'] and manifest['options'] != options :
+        logger.info("parse options or output columns changed; reparsing all files")
+        manifest['files'] = {}
+    manifest['options'] = options
+    files = manifest['files']
+
+    # find new and changed files
+    todo = []
+    rebuild = False
+    for inFileName in inFileNames :
+        changed, entry = check_manifest(inFileName, files)
+        path = os.path.abspath(inFileName)
+        if changed is True :
+            todo.append((inFileName, entry))
+            if path in files : rebuild = True
+        else :
+            files[path] = entry
+    logger.info("%d unchanged files skipped, %d to parse", len(inFileNames) - len(todo), len(todo))
+
+    if shard is False and rebuild is True :
+        logger.info("previously parsed files changed; rewriting %s", outFileName)
+        files = manifest['files'] = {}
+        todo = [(inFileName, check_manifest(inFileName, {})[1]) for inFileName in inFileNames]
+    if shard is True and not os.path.isdir(outFileName) : os.makedirs(outFileName)
+
+    # append to single output, after the rows of the last completed file,
+    # dropping any rows of a file that failed partway through
+    out = None
+    if shard is False :
+        append = len(files) > 0
+        if append is True :
+            end = max(entry.get('end', 0) for entry in files.values())
+            with open(outFileName, 'r+b') as f : f.truncate(end)
+        out = writer_class(outFileName, KEYS, append=append)
+    extension = getattr(writer_class, 'extension', '')
+    shardNames = set(entry['shard'] for entry in files.values() if 'shard' in entry)
+    try :
+        for inFileName, entry in todo :
+            path = os.path.abspath(inFileName)
+            if shard is True :
+                # keep a file's shard name; give it a unique one the first time
+                name = files.get(path, {}).get('shard')
+                if name is None :
+                    name = os.path.basename(inFileName) + extension
+                    if name in shardNames :
+                        name = '%s-%s%s' % (os.path.basename(inFileName),
+                                            hashlib.sha1(path).hexdigest()[:8], extension)
+                    shardNames.add(name)
+                entry['shard'] = name
+                out = writer_class(os.path.join(outFileName, name), KEYS)
+            logger.info("parsing %s", inFileName)
+            with open(inFileName, 'r') as inFile :
+                for row in iter_lexis_nexis_docs(inFile, doPrint=doPrint, workers=workers,
+                                                 ordered=ordered, date_from=date_from,
+                                                 date_to=date_to) :
+                    out.writerow(row)
+            if shard is True :
+                out.close()
+                out = None
+            else :
+                out.flush()
+                entry['end'] = os.path.getsize(outFileName)
+            # record each file as soon as it's done, so interrupted runs can resume
+            files[path] = entry
+            save_manifest(manifest, manifestFileName)
+    finally :
+        if out is not None : out.close()
+    save_manifest(manifest, manifestFileName)
+    logger.info("output saved to %s", outFileName)
+
+
+################################################################################
+def build_lexis_nexis_index(inFileName, indexFileName = None, workers = 1) :
+    """Indexes documents of a LexisNexis output file for random access: finds
+    every "X of Y DOCUMENTS" boundary in a memory map of the file, and saves the
+    byte offsets of each document with its metadata in INDEX_KEYS (pub, pub
+    date and section) to a compact sidecar file.
+
+    @param inFileName: Path to and name of file containing LexisNexis output.
+    @type: string
+    @param indexFileName: Path to and name of index file; by default
+        inFileName + '.idx'
+    @type: string
+    @param workers: Number of processes parsing documents' metadata in parallel.
+    @type: int
+    """
+    if indexFileName is None : indexFileName = inFileName + INDEX_EXTENSION
+    stat = os.stat(inFileName)
+    starts = array.array('l')
+    ends = array.array('l')
+    # distinct values of each field, and each document's index into them
+    values = dict((key, []) for key in INDEX_KEYS)
+    codes = dict((key, array.array('i')) for key in INDEX_KEYS)
+    lookup = dict((key, {}) for key in INDEX_KEYS)
+    with open(inFileName, 'rb') as inFile :
+        data = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else ''
+        # documents run from the end of one boundary to the start of the next
+        boundaries = DOC_SEPARATOR.finditer(data)
+        for match in boundaries :
+            if len(starts) > 0 : ends.append(match.start())
+            starts.append(match.end())
+        if len(starts) > 0 : ends.append(len(data))
+        docs = (data[start:end] for start, end in itertools.izip(starts, ends))
+        if workers > 1 :
+            rows = _iter_parsed_in_pool(docs, workers, True, 64)
+        else :
+            rows = itertools.imap(parse_lexis_nexis_doc, docs)
+        for row in rows :
+            for key in INDEX_KEYS :
+                code = lookup[key].get(row[key])
+                if code is None :
+                    code = lookup[key][row[key]] = len(values[key])
+                    values[key].append(row[key])
+                codes[key].append(code)
+        if stat.st_size : data.close()
+
+    # header line of JSON, then offsets and codes as raw arrays
+    header = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime,
+              'n_docs': len(starts), 'itemsize': [starts.itemsize, codes['pub'].itemsize],
+              'values': values}
+    tmpFileName = indexFileName + '.tmp'
+    with open(tmpFileName, 'wb') as f :
+        # values are raw bytes of the export, kept as they are through latin-1
+        f.write(json.dumps(header, encoding='latin-1') + '\n')
+        starts.tofile(f)
+        ends.tofile(f)
+        for key in INDEX_KEYS : codes[key].tofile(f)
+    os.rename(tmpFileName, indexFileName)
+    return indexFileName
+
+
+################################################################################
+class LexisNexisIndex(object) :
+    """Random access to documents of a LexisNexis output file through its index
+    (see build_lexis_nexis_index), which is built first if missing or out of date.
+    Documents are numbered from 0 in file order, and read straight from a memory
+    map of the file, without reparsing anything else.
+    """
+
+    def __init__(self, inFileName, indexFileName = None, workers = 1) :
+        if indexFileName is None : indexFileName = inFileName + INDEX_EXTENSION
+        self.inFileName = inFileName
+        self.indexFileName = indexFileName
+        header = self._load()
+        if header is None :
+            build_lexis_nexis_index(inFileName, indexFileName, workers)
+            header = self._load()
+        self.inFile = open(inFileName, 'rb')
+        self.data = mmap.mmap(self.inFile.fileno(), 0, access=mmap.ACCESS_READ) if header['size'] else ''
+
+    def _load(self) :
+        """Loads index, or returns None if it's missing or out of date.
+        """
+        if not os.path.exists(self.indexFileName) : return None
+        stat = os.stat(self.inFileName)
+        with open(self.indexFileName, 'rb') as f :
+            header = json.loads(f.readline())
+            if header.get('version') != INDEX_VERSION : return None
+            if header['size'] != stat.st_size or header['mtime'] != stat.st_mtime :
+                return None
+            n_docs = header['n_docs']
+            self.starts = array.array('l')
+            self.ends = array.array('l')
+            if header['itemsize'] != [self.starts.itemsize, array.array('i').itemsize] :
+                return None
+            self.starts.fromfile(f, n_docs)
+            self.ends.fromfile(f, n_docs)
+            self.codes = {}
+            for key in INDEX_KEYS :
+                self.codes[key] = array.array('i')
+                self.codes[key].fromfile(f, n_docs)
+        self.values = dict((key, [value.encode('latin-1') for value in values])
+                           for key, values in header['values'].iteritems())
+        return header
+
+    def __len__(self) :
+        return len(self.starts)
+
+    def get_raw(self, k) :
+        """Gets raw text of document k.
+        """
+        return self.data[self.starts[k]:self.ends[k]]
+
+    def get(self, k) :
+        """Gets document k, parsed into a dict keyed by KEYS.
+        """
+        return parse_lexis_nexis_doc(self.get_raw(k))
+
+    def get_value(self, k, key) :
+        """Gets indexed metadata (any of INDEX_KEYS) of document k.
+        """
+        return self.values[key][self.codes[key][k]]
+
+    def filter(self, **conditions) :
+        """Gets numbers of documents matching all conditions on indexed metadata,
+        e.g. filter(pub='The New York Times', section=lambda s: 'Sports' in s,
+        pub_date_iso=lambda d: '2012-03-01' <= d <= '2012-03-31').
+        Each condition is a value to match exactly, or a function returning True
+        for values to match; it's checked once per distinct value, not per document,
+        and documents are then matched by their value codes all at once with numpy.
+        """
+        import numpy as np
+        match = np.ones(len(self), dtype=bool)
+        for key, condition in conditions.iteritems() :
+            if key not in INDEX_KEYS :
+                raise NameError("can only filter on " + ', '.join(INDEX_KEYS))
+            if not callable(condition) : condition = condition.__eq__
+            matching_codes = np.array([condition(value) is True for value in self.values[key]], dtype=bool)
+            if len(self) : match &= matching_codes[np.frombuffer(self.codes[key], dtype=np.intc)]
+        return np.flatnonzero(match).tolist()
+
+    def iter_docs(self, ks) :
+        """Yields parsed documents for document numbers ks, e.g. from filter.
+        """
+        for k in ks : yield self.get(k)
+
+    def close(self) :
+        if self.data : self.data.close()
+        self.inFile.close()
+
+
+# helpers called once per document or row, whose timing would cost about as
+# much as they do themselves
+instrumentation.instrument_module(sys.modules[__name__], exclude=[
+    'parse_pub_date', 'sort_header_lines', 'TSVWriter.writerow', 'ParquetWriter.writerow',
+    'LexisNexisIndex.get_raw', 'LexisNexisIndex.get_value'])